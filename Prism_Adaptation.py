@@ -4,15 +4,17 @@ import sys
 import sdl2
 import sdl2.ext
 from sdl2.ext import get_events, key_pressed, get_clicks
-from communication import get_trigger_port
 
 from math import nan, degrees, atan
 import random
 import time
-import shutil
 from instructions import instructions
-from aggdraw import Brush
-from resources import init_window, draw_circle, get_radius, get_mm, DataFile, pump, check_for_quit, waitForResponse
+from session import Session, init_trigger_port
+from columnar import CATEGORICAL_COLS
+from calibration import Calibration
+from timing import ClockAlignment, FrameScheduler, precise_wait
+from textures import TextureCache, GlyphAtlas, TextEntry, StimulusCache
+from resources import init_window, pump, wait_events, find_event, check_for_quit, waitForResponse
 
 # Initialize paths
 data_dir = "_Data"
@@ -26,18 +28,35 @@ data_cols = [
     "id", "created", "sex", "age", "handedness",
     "block", "group", "trial_num", "response_time", "reaction_time",
     "points_x", "points_y", "location_x", "location_y",
-    "distance_x", "distance_y", "run_time"
+    "distance_x", "distance_y", "run_time",
+    "reaction_time_event", "response_time_event",
+    "onset_to_start", "stim_duration", "late_frames",
+    "foreperiod", "foreperiod_actual", "goggles_delay_actual",
+    "points_x_px", "points_y_px", "location_x_px", "location_y_px",
+    "block_num"
     ] 
 
-# Trigger port for PLATO goggles
-port = get_trigger_port()
-
-# Indicates trial start for EMG collection
-port.add_codes({
-    'trial_start': 2,
-    'circle_on': 4,
-    'trial_end': 8
-})
+# Text columns stored as categories in columnar (-npy) data files
+categorical_cols = CATEGORICAL_COLS
+
+# Number of trials in each block type
+block_trials = {
+    "Familiarization": 40,
+    "Baseline": 10,
+    "Exposure": 25, #repeat 10 times (total 250 trials)
+    "PostTest": 10,
+}
+
+# Trigger port for PLATO goggles (sends triggers from a background thread)
+# (see session.TRIGGER_CODES for the EMG marker codes)
+port = init_trigger_port(simulate = "-simulate-u3" in sys.argv)
+
+# Creates and closes the data files, registry entry and trigger log for each
+# participant's session
+session = Session(
+    data_dir, data_cols, port, categorical = categorical_cols,
+    npy = "-npy" in sys.argv, sqlite = "-sqlite" in sys.argv
+)
 
 # Initialize and create the experiment window
 viewingDistance = 100
@@ -49,6 +68,14 @@ stimDisplayWidthInDegrees = degrees(
 )
 PPD = stimDisplayRes[0] / stimDisplayWidthInDegrees  # Pixels per degree
 
+# Pixel to mm conversion for the window's display (reused by later sessions)
+calibration = Calibration.for_window(
+    Window, os.path.join(data_dir, "calibration.json"), screensize = 24
+)
+
+# Maps SDL event timestamps onto the perf_counter clock for event-accurate RTs
+clock = ClockAlignment()
+
 # Create a renderer
 renderflags = sdl2.SDL_RENDERER_SOFTWARE 
 if "-hardware" in sys.argv:
@@ -57,6 +84,9 @@ if "-hardware" in sys.argv:
     )
 renderer = sdl2.ext.Renderer(Window, flags = renderflags)
 
+# Presents stimuli in sync with the display and records when they appear
+frames = FrameScheduler(renderer)
+
 # Define colours for the experiment
 # Colours
 black = (0,0,0)
@@ -68,12 +98,19 @@ fontsize = '{0}px'.format(int(PPD * 0.6))
 font = sdl2.ext.FontTTF(fontpath, fontsize, white)
 font.add_style("grey", fontsize, color = lightGrey)
 
-# Import an image file and convert it to a texture.
+# Pre-render all instruction screens so they appear without delay
+text_cache = TextureCache(renderer, font)
+text_cache.prerender(instructions.values(), width = 780, align = 'center')
+
+# Render all glyphs once for drawing typed text
+glyph_atlas = GlyphAtlas(renderer, font)
+
+# Draw the stimuli once and pack them into a texture.
 # A texture is an SDL surface that has been prepared for use with a given renderer
-fill = Brush((255, 0, 0, 255))
-r = get_radius(10) #specify 10 mm circle. This is default
-tst_img = draw_circle(r, fill)
-tx = sdl2.ext.Texture(renderer, tst_img)
+red = (255, 0, 0, 255)
+r = calibration.radius(10) #specify 10 mm circle. This is default
+stimuli = StimulusCache(renderer)
+stimuli.prewarm([(r, red)]) # Draw all stimuli before the first trial
 
 # location of the stimuli to be presented on the window
 screen_w, screen_h = renderer.logical_size
@@ -91,11 +128,14 @@ def update_text(renderer, surface):
     renderer: sdl2.ext.Renderer
         The renderer to be used 
     
-    surface: sdl2.SDL_surface
+    surface: sdl2.SDL_surface or sdl2.ext.Texture
         The contents to be updated to the renderer
     """ 
 
-    tx = sdl2.ext.Texture(renderer, surface)
+    if isinstance(surface, sdl2.ext.Texture):
+        tx = surface
+    else:
+        tx = sdl2.ext.Texture(renderer, surface)
     renderer.clear(black)
     renderer.rcopy(tx, loc = loc_mid, align = (0.5, 0.5))
     renderer.present()
@@ -112,7 +152,7 @@ def draw_text(myText):
     if isinstance(myText, list):
         myText = "\n".join(myText)
 
-    txt_rendered = font.render_text(myText, width = 780, align = 'center')
+    txt_rendered = text_cache.get(myText, width = 780, align = 'center')
     update_text(renderer, txt_rendered)
 
 def show_message(myText, lockWait = False):
@@ -142,7 +182,7 @@ def show_message(myText, lockWait = False):
     renderer.present()
     renderer.clear(black)
     draw_text(myText)
-    time.sleep(0.5)
+    precise_wait(0.5, on_events = check_for_quit, consume = False)
     renderer.present()
     renderer.clear(black)
     if lockWait:
@@ -153,7 +193,7 @@ def show_message(myText, lockWait = False):
         response = waitForResponse(terminate = True)[0][0]
     renderer.present()
     renderer.clear()
-    time.sleep(0.50)
+    precise_wait(0.5, on_events = check_for_quit, consume = False)
     messageViewingTime = time.perf_counter() - messageViewingTimeStart
     return [response, messageViewingTime]
 
@@ -173,34 +213,33 @@ def get_input(getWhat):
 
     renderer.clear(black)
     renderer.present()
-    time.sleep(0.50)
+    precise_wait(0.5, on_events = check_for_quit, consume = False)
 
     getWhat = sdl2.ext.compat.utf8(getWhat)
-    textInput = u''
-    myText = getWhat + '\n' + textInput
-    draw_text(myText)
+    entry = TextEntry(renderer, font, getWhat, loc_mid, width = 780, bg = black,
+        text_cache = text_cache, glyphs = glyph_atlas)
+    entry.draw()
     renderer.present()
 
     # Enter input into a collection loop
-    renderer.clear(black)
     sdl2.SDL_StartTextInput()
     done = False
     while not done: 
-        events = pump()
+        events = wait_events()
         check_for_quit(events)
         refresh = False
         for event in events: 
             # Check for new text input
             if event.type == sdl2.SDL_TEXTINPUT:
-                textInput += event.text.text.decode('utf-8')
-                refresh = True
+                if entry.insert(event.text.text.decode('utf-8')):
+                    refresh = True
             
             # Check for backspace or enter keys
             elif event.type == sdl2.SDL_KEYDOWN:
                 k = event.key.keysym
-                if len(textInput):
+                if len(entry.text):
                     if k.sym == sdl2.SDLK_BACKSPACE:
-                        textInput = textInput[:-1]
+                        entry.backspace()
                         refresh = True
                     elif k.sym in (sdl2.SDLK_KP_ENTER, sdl2.SDLK_RETURN):
                         done = True
@@ -208,16 +247,15 @@ def get_input(getWhat):
 
         # If necessary, update the contents of the screen
         if refresh: 
-            myText = getWhat + '\n' + textInput
-            renderer.clear(black)
-            draw_text(myText)
+            entry.draw()
             renderer.present()
 
     # Clear screen to black and return collected input
     renderer.clear(black)
     renderer.present()
     sdl2.SDL_StopTextInput()
-    textInput = textInput.strip() # remove any trailing whitespace
+    entry.destroy()
+    textInput = entry.text.strip() # remove any trailing whitespace
     return textInput
 
 def get_participant_info():
@@ -234,10 +272,8 @@ def get_participant_info():
     while True:
         participant_id = get_input('ID (\'test\' to demo): ')
         participant_id = participant_id.upper() #ensures that all files with have capitalized values
-        folder = '_Data'
-        sub_folders = [name for name in os.listdir(folder) if os.path.isdir(os.path.join(folder,name))] # Grabs all the folder names in the folder _Data
-        # Raises message if subject folder already exists
-        if (participant_id in sub_folders) and participant_id.lower() != 'test':
+        # Raises message if participant has already been run
+        if session.registry.exists(participant_id) and participant_id.lower() != 'test':
             show_message('This file already exists\nPlease input new participant code\nPress Enter to continue', lockWait = True)
             continue
         else: 
@@ -294,10 +330,15 @@ def get_participant_info():
     return info
 
 def open_goggles():
-    port._write_trigger(0, port = 'FIO')
+    port.write(0, port = 'FIO')
 
-def close_goggles():
-    port._write_trigger(3, port = 'FIO')
+def close_goggles(marker = None):
+    if marker:
+        # Close the goggles in the same port write as the EMG marker, so they
+        # happen at exactly the same time
+        port.send(marker, hold = {'FIO': 3})
+    else:
+        port.write(3, port = 'FIO')
 
 def run_trial(block, group, participant_info):
     """Parameters for different trial types of a reach and point task
@@ -331,48 +372,78 @@ def run_trial(block, group, participant_info):
     port.send('trial_start')
 
     # PLATO goggles open
-    port._write_trigger(0)
+    port.write(0)
 
     # Initialize trial data
     data = participant_info.copy()
     data['reaction_time'] = nan
+    data['reaction_time_event'] = nan
+    data['response_time_event'] = nan
+    data['foreperiod'] = nan
+    data['foreperiod_actual'] = nan
+
+    # Stops the foreperiod early if the spacebar is released
+    def released_early(events):
+        check_for_quit(events)
+        return key_pressed(events, key = 'space', released = True)
+
+    # Update the SDL clock alignment to correct for any drift
+    clock.sync()
     
     while True: 
-        events = pump()
+        events = wait_events()
         check_for_quit(events)
         wait_time = (random.randint(400, 600))/1000  
         if key_pressed(events, key = 'space'):
-            time.sleep(wait_time) # Wait between 400-600 ms before presenting stimuli 
-            events = get_events()
+            # Wait between 400-600 ms before presenting stimuli
+            waited, early = precise_wait(wait_time, on_events = released_early)
+            data['foreperiod'] = wait_time*1000
+            data['foreperiod_actual'] = waited*1000
             # If the spacebar is release prior to stimulus shown,
             # Error message "too fast" is displayed
-            if key_pressed(events, key = 'space', released = True ):
+            if early:
                 show_message("Too fast!\nPress Enter to try again", lockWait = True)
                 get_events()
                 continue
             break
 
+    # Synchronize with the display so the stimulus appears on the next refresh
+    renderer.clear(black)
+    frames.align()
+
     # Shows circle stimuli on the renderer
     renderer.clear(black)
     location = random.choice(loc_opt)
-    renderer.rcopy(tx, loc= location, align = (0.5, 0.5)) #show stimuli at one of 3 random locations
-    renderer.present()
+    stimuli.draw(r, red, loc = location, align = (0.5, 0.5)) #show stimuli at one of 3 random locations
+    onset = frames.flip()
     port.send('circle_on')
     start_time = time.perf_counter() # Grabs start time to measure reaction time
+    offset = None
+
+    # Record how long after the stimulus actually appeared the RT clock started
+    data['onset_to_start'] = (start_time - onset.time)*1000
     events = pump()        
 
     # x and y location of the simuli 
-    location_x = get_mm(location[0]) 
-    location_y = get_mm(location[1])
+    location_x = calibration.x_to_mm(location[0]) 
+    location_y = calibration.y_to_mm(location[1])
+
+    # Raw pixel locations, so data can be reprocessed with a new calibration
+    data['location_x_px'] = location[0]
+    data['location_y_px'] = location[1]
+    data['points_x_px'] = nan
+    data['points_y_px'] = nan
 
     # Gathers response time for motor imagery and control groups
     response_time = None
     if ((block == "Exposure") and group in ["MI-CE", "MI-TE", "CTRL"]):
         while not response_time:
-            events = pump()
+            events = wait_events()
             check_for_quit(events)
             if key_pressed(events, key = "space", released = True):
                 response_time = (time.perf_counter() - start_time)*1000
+                release = find_event(events, sdl2.SDL_KEYUP, key = 'space')
+                data['response_time_event'] = (clock.event_time(release) - onset.time)*1000
                 points_x = nan
                 points_y = nan
                 data.update({
@@ -389,12 +460,12 @@ def run_trial(block, group, participant_info):
         # Clear screen when spacebar is unclicked
         get_events()
         renderer.clear(black)
-        renderer.present()
+        offset = frames.flip()
     
     if block in ["Baseline", "PostTest"]:
         # Grabs distance x, distance y, response time, and reaction time during a physical practice trial
         while not response_time:
-            events = pump()
+            events = wait_events()
             check_for_quit(events)
 
             # Grabs reaction time. 
@@ -403,7 +474,9 @@ def run_trial(block, group, participant_info):
 
             if key_pressed(events, key = 'space', released = True): 
                 reaction_time = (time.perf_counter() - start_time)*1000 
-                close_goggles() 
+                release = find_event(events, sdl2.SDL_KEYUP, key = 'space')
+                data['reaction_time_event'] = (clock.event_time(release) - onset.time)*1000
+                close_goggles('release')
                 data.update({
                     'reaction_time': reaction_time
                 })
@@ -415,9 +488,12 @@ def run_trial(block, group, participant_info):
             # Time from when stimulus is presented to time when stimulus is touched
             if len(points) > 0:
                 response_time = (time.perf_counter() - start_time)*1000
+                click = find_event(events, sdl2.SDL_MOUSEBUTTONDOWN)
+                data['response_time_event'] = (clock.event_time(click) - onset.time)*1000
 
-                points_x = get_mm(points[0][0])
-                points_y = get_mm(points[0][1])
+                data['points_x_px'], data['points_y_px'] = points[0]
+                points_x = calibration.x_to_mm(points[0][0])
+                points_y = calibration.y_to_mm(points[0][1])
                 distance_x = points_x - location_x
                 distance_y = points_y - location_y
                 data.update({
@@ -433,7 +509,7 @@ def run_trial(block, group, participant_info):
     else:
         # Grabs distance x, distance y, response time, and reaction time during a physical practice trial
         while not response_time:
-            events = pump()
+            events = wait_events()
             check_for_quit(events)
 
             # Grabs reaction time. 
@@ -441,6 +517,8 @@ def run_trial(block, group, participant_info):
             reaction_time = None
             if key_pressed(events, key = 'space', released = True): 
                 reaction_time = (time.perf_counter() - start_time)*1000 
+                release = find_event(events, sdl2.SDL_KEYUP, key = 'space')
+                data['reaction_time_event'] = (clock.event_time(release) - onset.time)*1000
                 data.update({
                     'reaction_time': reaction_time
                 })
@@ -452,8 +530,11 @@ def run_trial(block, group, participant_info):
             # Time from when stimulus is presented to time when stimulus is touched
             if len(points) > 0:
                 response_time = (time.perf_counter() - start_time)*1000
-                points_x = get_mm(points[0][0])
-                points_y = get_mm(points[0][1])
+                click = find_event(events, sdl2.SDL_MOUSEBUTTONDOWN)
+                data['response_time_event'] = (clock.event_time(click) - onset.time)*1000
+                data['points_x_px'], data['points_y_px'] = points[0]
+                points_x = calibration.x_to_mm(points[0][0])
+                points_y = calibration.y_to_mm(points[0][1])
                 distance_x = points_x - location_x
                 distance_y = points_y - location_y
                 data.update({
@@ -468,14 +549,19 @@ def run_trial(block, group, participant_info):
             
     get_events()
     renderer.clear(black) 
-    renderer.present()
+    flip = frames.flip()
+    if offset is None:
+        offset = flip
+    data['stim_duration'] = (offset.time - onset.time)*1000
+    data['late_frames'] = onset.late_frames + offset.late_frames
     port.send('trial_end')
-    time.sleep(0.25) # Wait 250 ms before opening goggles
+    waited, _ = precise_wait(0.25, on_events = check_for_quit, consume = False) # Wait 250 ms before opening goggles
+    data['goggles_delay_actual'] = waited*1000
     open_goggles()
     return data
 
 
-def run_block(block, group, participant_info, df):
+def run_block(block, group, participant_info, df, block_num = 0, journal = None, start_trial = 0):
     """Defines the different blocks types
 
     Familiarization: 40 trials
@@ -498,107 +584,133 @@ def run_block(block, group, participant_info, df):
         A dictionary containing participant info
     df: Datafile obj
         Datafile containing experiment data
+    block_num: int, optional
+        The position of the block in the session, recorded in the journal
+    journal: Journal obj, optional
+        Journal to record each completed trial in for crash recovery
+    start_trial: int, optional
+        The number of trials in the block already completed, when resuming
+        an interrupted session (default 0)
     """
     
-    if block == "Familiarization":
-        trial_num = 40
-    elif block in ["Baseline", "PostTest"]:
-        trial_num = 10
-    elif block == "Exposure":
-        trial_num = 25 #repeat 10 times (total 250 trials)
-    trials = 0
+    trial_num = block_trials[block]
     start_time = time.time()
-    for i in range(trial_num):
-            trials += 1
+    for trials in range(start_trial + 1, trial_num + 1):
+            port.log.set_trial(block_num, trials)
             data = run_trial(block, group, participant_info)
             data["trial_num"] = trials
             end_time = time.time()
             run_time = end_time - start_time
             data["run_time"] = run_time
             data["block"] = block
+            data["block_num"] = block_num
             data["group"] = group
             df.write_row(data)
+            if journal:
+                journal.append('trial', block_num = block_num, data = data)
+
+    # Save the block's trials and the times of its trigger writes
+    session.end_block()
+
+def resume_session():
+    """Reloads an interrupted session from the participant's journal
+
+    Asks for the ID of the participant to resume, restores their info, and
+    rewrites the data file with all trials completed before the interruption.
 
-def init_data(participant_id):
-    """Creates a participant data folder with experiment data and experiment code
-    
-    Parameters
-    ----------
-    participant_id: dict
-        A dictionary of participant data
-    
     Returns
     -------
     dict
-        A dictionary containing data output files for the participant
+        A dictionary of participant info
+    dict
+        A dictionary of the number of trials completed in each block number
     """
 
-    # Create the data folder for the participant
-    filebase = participant_id
-    participant_dir = os.path.join(data_dir, filebase)
-    if not os.path.exists(participant_dir):
-        os.mkdir(participant_dir)
-
-    # Make a copy of the code the experiment was run with
-    code_path = os.path.join(participant_dir, filebase + "_code.py")
-    shutil.copy(sys.argv[0], code_path)
-
-    # Get the data outputs for the participant
-    data_path = os.path.join(participant_dir, filebase + "reach_and_point.csv")
+    while True:
+        participant_id = get_input('ID to resume: ').upper()
+        info, _, _, complete = session.read_progress(participant_id)
+        if info is None:
+            show_message('No session found to resume\nPlease input another participant code\nPress Enter to continue', lockWait = True)
+            continue
+        elif complete:
+            show_message('This session is already complete\nPlease input another participant code\nPress Enter to continue', lockWait = True)
+            continue
+        break
 
-    # Create data output files for the participant
-    df = {'Data': DataFile(data_path, data_cols, sep = ',')}
+    # Recreate the data file from the journal, so it matches it exactly
+    return session.resume(participant_id)
 
-    return df
+def block_done(block, block_num, progress):
+    # Checks whether all trials in a given block have already been completed
+    return progress.get(block_num, 0) >= block_trials[block]
 
 ### Actually run the experiment ###
 def run():
     """Runs the experiment from start to end
+
+    If the script is run with the '-resume' flag, an interrupted session is
+    reloaded from its journal and continues from the next incomplete trial.
     """
 
-    participant_info = get_participant_info()
-    participant_id = participant_info['id']
+    if "-resume" in sys.argv:
+        participant_info, progress = resume_session()
+    else:
+        participant_info = get_participant_info()
+        # Create data folder/files for the participant
+        session.start(participant_info)
+        progress = {}
     group = participant_info['group']
-
-    # Create data folder/files for the participant
-    df = init_data(participant_id)
+    journal = session.journal
 
     # Familiarization block
-    show_message(instructions["Familiarization"], lockWait = True)
-    run_block(block = 'Familiarization', group = group, participant_info = participant_info, df = df['Data'])
+    if not block_done('Familiarization', 1, progress):
+        show_message(instructions["Familiarization"], lockWait = True)
+        run_block(block = 'Familiarization', group = group, participant_info = participant_info, df = session.data,
+            block_num = 1, journal = journal, start_trial = progress.get(1, 0))
 
-    # Break, study investigator swaps glasses/goggles/prisms
-    show_message(instructions["get_study_investigator"], lockWait = True)
+        # Break, study investigator swaps glasses/goggles/prisms
+        show_message(instructions["get_study_investigator"], lockWait = True)
 
     # Baseline block
-    show_message(instructions["Baseline"], lockWait = True)
-    run_block(block = 'Baseline', group = group, participant_info = participant_info, df = df['Data'])
+    if not block_done('Baseline', 2, progress):
+        show_message(instructions["Baseline"], lockWait = True)
+        run_block(block = 'Baseline', group = group, participant_info = participant_info, df = session.data,
+            block_num = 2, journal = journal, start_trial = progress.get(2, 0))
 
-    # Break, study investigator swaps glasses/goggles/prisms
-    show_message(instructions["get_study_investigator"], lockWait = True)
+        # Break, study investigator swaps glasses/goggles/prisms
+        show_message(instructions["get_study_investigator"], lockWait = True)
 
     # Exposure block
-    if group == 'PP':
-        show_message(instructions["Exposure_PP"], lockWait = True)
-    elif group in ['MI-CE', 'MI-TE']:
-        show_message(instructions["Exposure_MI"], lockWait = True)
-    elif group == 'CTRL':
-        show_message(instructions["Exposure_CTRL"], lockWait = True)
-
     numTestingBlocks = 10
-    for blockNum in range(numTestingBlocks):
-        run_block(block = 'Exposure', group = group, participant_info = participant_info, df = df['Data'])
-        if blockNum < (numTestingBlocks- 1 ):
-            show_message('Take a break!\nTo resume, press return.', lockWait = True)
+    exposure_nums = range(3, 3 + numTestingBlocks)
+    if not all(block_done('Exposure', n, progress) for n in exposure_nums):
+        if group == 'PP':
+            show_message(instructions["Exposure_PP"], lockWait = True)
+        elif group in ['MI-CE', 'MI-TE']:
+            show_message(instructions["Exposure_MI"], lockWait = True)
+        elif group == 'CTRL':
+            show_message(instructions["Exposure_CTRL"], lockWait = True)
+
+        for blockNum in range(numTestingBlocks):
+            block_num = exposure_nums[blockNum]
+            if block_done('Exposure', block_num, progress):
+                continue
+            run_block(block = 'Exposure', group = group, participant_info = participant_info, df = session.data,
+                block_num = block_num, journal = journal, start_trial = progress.get(block_num, 0))
+            if blockNum < (numTestingBlocks- 1 ):
+                show_message('Take a break!\nTo resume, press return.', lockWait = True)
     
-    # Break, study investigator swaps glasses/goggles/prisms
-    show_message(instructions["get_study_investigator"], lockWait = True)
+        # Break, study investigator swaps glasses/goggles/prisms
+        show_message(instructions["get_study_investigator"], lockWait = True)
 
     # PostTest block
+    posttest_num = 3 + numTestingBlocks
     show_message(instructions["PostTest"], lockWait = True)
-    run_block(block = 'PostTest', group = group, participant_info = participant_info, df = df['Data'])
+    run_block(block = 'PostTest', group = group, participant_info = participant_info, df = session.data,
+        block_num = posttest_num, journal = journal, start_trial = progress.get(posttest_num, 0))
 
     # Study complete!
+    session.complete()
     show_message(instructions["done"], lockWait = True)
 
    
@@ -0,0 +1,201 @@
+"""Builds a study-wide dataset from all participant data files.
+
+Walks the data folder for participant data files, parses them in parallel
+with a pool of worker processes, and merges them into a single dataset.
+Parsed files are cached (keyed by their path, modification time, and size),
+so re-running after a new session only parses the new file::
+
+    python aggregate.py                      # writes _Data/study_data.csv
+    python aggregate.py -o study.csv -j 4
+
+"""
+import os
+import io
+import sys
+import json
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from analysis import load_file, combine_tables, write_table
+
+# Suffix of the data files written for each participant
+DATA_SUFFIX = "reach_and_point.csv"
+
+CACHE_DIRNAME = ".cache"
+CACHE_INDEX = "index.json"
+
+
+def find_data_files(data_dir, include_test=False):
+    """Finds all participant data files in the data folder.
+
+    Args:
+        data_dir (str): The path of the data folder.
+        include_test (bool, optional): Whether to include data from the 'test'
+            demo participant. Defaults to False.
+
+    Returns:
+        list: The paths of all participant data files, sorted by participant.
+
+    """
+    paths = []
+    for entry in sorted(os.scandir(data_dir), key=lambda e: e.name):
+        if not entry.is_dir() or entry.name == CACHE_DIRNAME:
+            continue
+        if entry.name.lower() == 'test' and not include_test:
+            continue
+        for name in sorted(os.listdir(entry.path)):
+            if name.endswith(DATA_SUFFIX):
+                paths.append(os.path.join(entry.path, name))
+    return paths
+
+
+def _file_key(path):
+    # Files are re-parsed if their modification time or size changes
+    st = os.stat(path)
+    return [st.st_mtime_ns, st.st_size]
+
+
+def _cache_name(path):
+    digest = hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()
+    return digest + ".npz"
+
+
+def _parse(path, cache_path):
+    # Parses a data file and saves the result to the cache (in a worker)
+    table = load_file(path)
+    tmp_path = cache_path + ".tmp"
+    with io.open(tmp_path, 'wb') as f:
+        np.savez(f, **table)
+    os.replace(tmp_path, cache_path)
+    return path
+
+
+def _load_cached(cache_path):
+    with np.load(cache_path, allow_pickle=False) as cached:
+        return {col: cached[col] for col in cached.files}
+
+
+class ParseCache(object):
+    """A cache of parsed participant data files.
+
+    Each parsed file is stored as an ``.npz`` file in the cache folder, and an
+    index records the modification time and size of the data file it was
+    parsed from.
+
+    Args:
+        cache_dir (str): The path of the cache folder. Will be created if it
+            doesn't already exist.
+
+    """
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        self._index_path = os.path.join(cache_dir, CACHE_INDEX)
+        self.index = {}
+        if os.path.exists(self._index_path):
+            with io.open(self._index_path, 'r', encoding='utf-8') as f:
+                self.index = json.load(f)
+
+    def cache_path(self, path):
+        return os.path.join(self.cache_dir, _cache_name(path))
+
+    def is_current(self, path):
+        """Checks whether a data file's cached result is up to date.
+
+        """
+        entry = self.index.get(path)
+        return (
+            entry is not None and entry == _file_key(path)
+            and os.path.exists(self.cache_path(path))
+        )
+
+    def update(self, path):
+        self.index[path] = _file_key(path)
+
+    def prune(self, paths):
+        """Removes cached results for data files that no longer exist.
+
+        """
+        for path in set(self.index) - set(paths):
+            del self.index[path]
+            if os.path.exists(self.cache_path(path)):
+                os.remove(self.cache_path(path))
+
+    def save(self):
+        tmp_path = self._index_path + ".tmp"
+        with io.open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.index, f)
+        os.replace(tmp_path, self._index_path)
+
+
+def aggregate(data_dir, jobs=None, rebuild=False, include_test=False):
+    """Parses all participant data files and merges them into one table.
+
+    Only files that have changed since they were last parsed are re-parsed,
+    using a pool of worker processes.
+
+    Args:
+        data_dir (str): The path of the data folder.
+        jobs (int, optional): The number of worker processes to use. Defaults
+            to the number of CPUs.
+        rebuild (bool, optional): Whether to ignore the cache and re-parse
+            every file. Defaults to False.
+        include_test (bool, optional): Whether to include data from the 'test'
+            demo participant. Defaults to False.
+
+    Returns:
+        tuple: The merged table (see `analysis.load_data`), and the number of
+        files that had to be parsed.
+
+    """
+    paths = find_data_files(data_dir, include_test)
+    cache = ParseCache(os.path.join(data_dir, CACHE_DIRNAME))
+    cache.prune(paths)
+    stale = [p for p in paths if rebuild or not cache.is_current(p)]
+
+    if len(stale) == 1 or jobs == 1:
+        for path in stale:
+            _parse(path, cache.cache_path(path))
+    elif stale:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            cache_paths = [cache.cache_path(p) for p in stale]
+            list(pool.map(_parse, stale, cache_paths))
+    for path in stale:
+        cache.update(path)
+    cache.save()
+
+    tables = [_load_cached(cache.cache_path(p)) for p in paths]
+    return combine_tables(tables), len(stale)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument('-d', '--data-dir', default="_Data",
+        help="the data folder to aggregate (default: _Data)")
+    parser.add_argument('-o', '--output', default=None,
+        help="where to write the merged dataset (default: <data-dir>/study_data.csv)")
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+        help="number of worker processes (default: number of CPUs)")
+    parser.add_argument('--rebuild', action='store_true',
+        help="ignore cached results and re-parse every file")
+    parser.add_argument('--include-test', action='store_true',
+        help="include data from the 'test' demo participant")
+    args = parser.parse_args(argv)
+
+    output = args.output or os.path.join(args.data_dir, "study_data.csv")
+    table, parsed = aggregate(
+        args.data_dir, args.jobs, args.rebuild, args.include_test
+    )
+    write_table(table, output)
+    nrows = len(next(iter(table.values()))) if table else 0
+    print("Parsed {0} new or changed file(s), wrote {1} rows to {2}".format(
+        parsed, nrows, output
+    ))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,405 @@
+"""Aftereffect and response time analysis for reach and point data.
+
+Loads one or more participant data files (CSVs written by DataFile, or
+``.npy`` arrays written by ColumnarDataFile) into a single table, and
+computes per-participant and per-group summaries:
+
+- mean horizontal error (distance_x) in the Baseline and PostTest blocks,
+  and the aftereffect (PostTest minus Baseline),
+- exposure learning curves (mean distance_x for each exposure trial),
+- reaction and response time summaries for each block.
+
+Touch and target locations can also be recomputed from the raw pixel
+coordinates in the data (e.g. with a corrected screen calibration).
+
+Tables are dicts mapping column names to equal-length NumPy arrays, and all
+summaries are computed with vectorized grouping rather than looping over
+rows. To print the aftereffects for a set of data files::
+
+    python analysis.py _Data/*/*reach_and_point.csv
+
+"""
+import io
+import csv
+import sys
+
+import numpy as np
+
+from columnar import read_csv, load_session, decode, column_kinds
+
+# Block names used to compute aftereffects
+BASELINE_BLOCK = "Baseline"
+POSTTEST_BLOCK = "PostTest"
+EXPOSURE_BLOCKS = ["Exposure", "MIExposure"]
+
+
+def _float_or_nan(text):
+    try:
+        return float(text)
+    except ValueError:
+        return np.nan
+
+
+def _to_numeric(text):
+    # Converts an array of text to floats, with non-numeric text as NaN
+    text = np.asarray(text, dtype=str)
+    try:
+        return text.astype(float)
+    except ValueError:
+        # Some values aren't numbers (e.g. an age of 'test'), so convert each
+        # unique value separately and treat any that fail as missing
+        uniques, inverse = np.unique(text, return_inverse=True)
+        converted = np.array([_float_or_nan(u) for u in uniques])
+        return converted[inverse.ravel()]
+
+
+def load_data(paths, sep=',', categorical=None):
+    """Loads and combines one or more participant data files into a table.
+
+    Data files can be CSVs written by DataFile (comment lines starting with
+    '#' are ignored) or ``.npy`` session arrays written by ColumnarDataFile.
+    Categorical columns (by default `columnar.CATEGORICAL_COLS` for CSVs, and
+    the columns saved as categories for ``.npy`` files) are kept as text,
+    whole-number columns (e.g. trial_num) are converted to integers, and all
+    other columns are converted to floats, with NaN for missing or
+    non-numeric values.
+
+    Args:
+        paths (list): The paths of the data files to load.
+        sep (str, optional): The delimiter used in CSV files. Defaults to ','.
+        categorical (list, optional): The names of the columns in CSV files to
+            keep as text. Defaults to `columnar.CATEGORICAL_COLS`.
+
+    Returns:
+        dict: A table mapping column names to arrays, containing the rows of
+        all files in order. Only columns present in every file are included.
+
+    """
+    if isinstance(paths, str):
+        paths = [paths]
+    return combine_tables([load_file(path, sep, categorical) for path in paths])
+
+
+def combine_tables(tables):
+    """Combines a list of tables into a single table.
+
+    Args:
+        tables (list): The tables to combine, in order.
+
+    Returns:
+        dict: A table containing the rows of all tables in order. Only columns
+        present in every table are included.
+
+    """
+    if not tables:
+        return {}
+    cols = [c for c in tables[0].keys() if all(c in t for t in tables)]
+    return {col: np.concatenate([t[col] for t in tables]) for col in cols}
+
+
+def load_file(path, sep=',', categorical=None):
+    """Loads a single participant data file into a table.
+
+    See `load_data` for the supported file types and column conversions.
+
+    Args:
+        path (str): The path of the data file to load.
+        sep (str, optional): The delimiter used in CSV files. Defaults to ','.
+        categorical (list, optional): The names of the columns in CSV files to
+            keep as text. Defaults to `columnar.CATEGORICAL_COLS`.
+
+    Returns:
+        dict: A table mapping column names to arrays.
+
+    """
+    if path.endswith('.npy'):
+        arr, categories = load_session(path)
+        table = {}
+        for col, kind in column_kinds(arr.dtype.names, list(categories)).items():
+            if kind == 'category':
+                table[col] = decode(arr, categories, col).astype(str)
+            elif kind == 'int':
+                table[col] = np.asarray(arr[col], dtype=int)
+            else:
+                table[col] = np.asarray(arr[col], dtype=float)
+        return table
+
+    header, rows = read_csv(path, sep)
+    text = np.array(rows, dtype=str).reshape(len(rows), len(header))
+    table = {}
+    for i, (col, kind) in enumerate(column_kinds(header, categorical).items()):
+        if kind == 'category':
+            table[col] = text[:, i]
+        else:
+            table[col] = _to_numeric(text[:, i])
+            # Keep whole-number columns (e.g. trial_num) as integers if possible
+            if kind == 'int' and not np.isnan(table[col]).any():
+                table[col] = table[col].astype(int)
+    return table
+
+
+def select(table, mask):
+    """Gets the rows of a table where a boolean mask is True.
+
+    Args:
+        table (dict): A table from `load_data`.
+        mask (numpy.ndarray): A boolean array with one value per row.
+
+    Returns:
+        dict: A new table containing only the selected rows.
+
+    """
+    return {col: values[mask] for col, values in table.items()}
+
+
+def group_stats(keys, values):
+    """Computes the count, mean, and SD of values within groups.
+
+    Missing values (NaN) are ignored. Groups are returned in sorted key
+    order.
+
+    Args:
+        keys (list): A list of arrays (one value per row) whose combined
+            values define the groups.
+        values (numpy.ndarray): The values to summarize.
+
+    Returns:
+        dict: A table with one row per group, containing the key columns
+        (named 'key0', 'key1', ...) and the 'n', 'mean', and 'sd' of the
+        values in each group.
+
+    """
+    values = np.asarray(values, dtype=float)
+    if len(values) == 0:
+        out = {"key{0}".format(i): np.asarray(k)[:0] for i, k in enumerate(keys)}
+        out.update({'n': np.zeros(0, int), 'mean': np.zeros(0), 'sd': np.zeros(0)})
+        return out
+
+    # Find the unique combinations of keys and which group each row is in
+    codes = []
+    uniques = []
+    for k in keys:
+        u, inv = np.unique(np.asarray(k), return_inverse=True)
+        uniques.append(u)
+        codes.append(inv.ravel())
+    combined = np.ravel_multi_index(codes, [len(u) for u in uniques])
+    groups, inverse = np.unique(combined, return_inverse=True)
+    inverse = inverse.ravel()
+
+    # Sum the values and squared deviations within each group, ignoring NaNs
+    valid = ~np.isnan(values)
+    ngroups = len(groups)
+    n = np.bincount(inverse[valid], minlength=ngroups)
+    total = np.bincount(inverse[valid], values[valid], minlength=ngroups)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = total / n
+        dev = values[valid] - mean[inverse[valid]]
+        ss = np.bincount(inverse[valid], dev ** 2, minlength=ngroups)
+        sd = np.where(n > 1, np.sqrt(ss / (n - 1)), np.nan)
+
+    out = {}
+    group_codes = np.unravel_index(groups, [len(u) for u in uniques])
+    for i, (u, c) in enumerate(zip(uniques, group_codes)):
+        out["key{0}".format(i)] = u[c]
+    out.update({'n': n, 'mean': mean, 'sd': sd})
+    return out
+
+
+def _rename(table, names):
+    return {names.get(col, col): values for col, values in table.items()}
+
+
+def aftereffects(data):
+    """Computes the prism aftereffect for each participant.
+
+    The aftereffect is the mean horizontal error (distance_x, in mm) in the
+    PostTest block minus the mean horizontal error in the Baseline block.
+
+    Args:
+        data (dict): A table from `load_data`.
+
+    Returns:
+        dict: A table with one row per participant, containing their 'id',
+        'group', 'baseline_mean', 'posttest_mean', and 'aftereffect'.
+
+    """
+    ids, id_codes = np.unique(data['id'], return_inverse=True)
+    id_codes = id_codes.ravel()
+
+    # Get each participant's group from their first row
+    first = np.unique(id_codes, return_index=True)[1]
+    groups = data['group'][first]
+
+    means = {}
+    for block in (BASELINE_BLOCK, POSTTEST_BLOCK):
+        in_block = data['block'] == block
+        stats = group_stats([id_codes[in_block]], data['distance_x'][in_block])
+        block_means = np.full(len(ids), np.nan)
+        block_means[stats['key0']] = stats['mean']
+        means[block] = block_means
+
+    return {
+        'id': ids,
+        'group': groups,
+        'baseline_mean': means[BASELINE_BLOCK],
+        'posttest_mean': means[POSTTEST_BLOCK],
+        'aftereffect': means[POSTTEST_BLOCK] - means[BASELINE_BLOCK],
+    }
+
+
+def group_aftereffects(per_participant):
+    """Summarizes participants' aftereffects within each group.
+
+    Args:
+        per_participant (dict): A table from `aftereffects`.
+
+    Returns:
+        dict: A table with one row per group, containing the 'group', the
+        number of participants with an aftereffect ('n'), and the 'mean' and
+        'sd' of their aftereffects.
+
+    """
+    stats = group_stats([per_participant['group']], per_participant['aftereffect'])
+    return _rename(stats, {'key0': 'group'})
+
+
+def exposure_trial_index(data):
+    """Numbers each participant's exposure trials in order, starting at 1.
+
+    Exposure is run as a series of blocks that each restart trial_num at 1,
+    so this gives the position of each trial within the whole exposure phase.
+    Rows outside of exposure blocks are numbered 0.
+
+    Args:
+        data (dict): A table from `load_data`.
+
+    Returns:
+        numpy.ndarray: The exposure trial number of each row.
+
+    """
+    exposure = np.isin(data['block'], EXPOSURE_BLOCKS)
+    index = np.zeros(len(exposure), dtype=int)
+    ids = data['id'][exposure]
+    if len(ids) == 0:
+        return index
+
+    # Rows are in trial order within each participant, so count up from the
+    # start of each participant's run of exposure rows (after a stable sort)
+    order = np.argsort(ids, kind='stable')
+    sorted_ids = ids[order]
+    starts = np.r_[True, sorted_ids[1:] != sorted_ids[:-1]]
+    start_pos = np.maximum.accumulate(np.where(starts, np.arange(len(ids)), 0))
+    counts = np.empty(len(ids), dtype=int)
+    counts[order] = np.arange(len(ids)) - start_pos + 1
+    index[exposure] = counts
+    return index
+
+
+def learning_curves(data, by_group=True):
+    """Computes exposure learning curves.
+
+    Args:
+        data (dict): A table from `load_data`.
+        by_group (bool, optional): If True, average each exposure trial across
+            the participants in each group. If False, give a curve for each
+            participant. Defaults to True.
+
+    Returns:
+        dict: A table with one row per group (or participant) and exposure
+        trial, containing the 'group' (or 'id'), 'exposure_trial', and the
+        'n', 'mean', and 'sd' of distance_x.
+
+    """
+    index = exposure_trial_index(data)
+    exposure = index > 0
+    key = 'group' if by_group else 'id'
+    stats = group_stats(
+        [data[key][exposure], index[exposure]], data['distance_x'][exposure]
+    )
+    return _rename(stats, {'key0': key, 'key1': 'exposure_trial'})
+
+
+def rt_summary(data, by_group=False):
+    """Summarizes reaction and response times within each block type.
+
+    Args:
+        data (dict): A table from `load_data`.
+        by_group (bool, optional): If True, summarize across the participants
+            in each group. If False, summarize each participant. Defaults to
+            False.
+
+    Returns:
+        dict: A table with one row per participant (or group) and block type,
+        containing the 'id' (or 'group'), 'block', and the 'n', 'mean', and
+        'sd' of both 'reaction_time' and 'response_time' (e.g.
+        'reaction_time_mean').
+
+    """
+    key = 'group' if by_group else 'id'
+    out = {}
+    for measure in ('reaction_time', 'response_time'):
+        stats = group_stats([data[key], data['block']], data[measure])
+        out[key] = stats['key0']
+        out['block'] = stats['key1']
+        for stat in ('n', 'mean', 'sd'):
+            out["{0}_{1}".format(measure, stat)] = stats[stat]
+    return out
+
+
+def reprocess(data, calibration, origin=None):
+    """Recomputes touch locations and pointing errors from raw pixel data.
+
+    Uses the raw pixel coordinates recorded for each trial ('points_x_px',
+    'points_y_px', 'location_x_px', and 'location_y_px') to recompute the
+    mm columns with a given calibration, for all trials at once.
+
+    Args:
+        data (dict): A table from `load_data`.
+        calibration (calibration.Calibration): The calibration to use.
+        origin (tuple, optional): The (x, y) pixel coordinates reaches start
+            from, for computing angular errors. Defaults to the bottom center
+            of the display.
+
+    Returns:
+        dict: A copy of the table with the 'points', 'location', and
+        'distance' columns recomputed, and the 'radial_error' (in mm) and
+        'angular_error' (in degrees) of each trial added.
+
+    """
+    px_cols = ['points_x_px', 'points_y_px', 'location_x_px', 'location_y_px']
+    missing = [col for col in px_cols if col not in data]
+    if missing:
+        e = "Data is missing the raw pixel columns needed to reprocess it ({0})."
+        raise RuntimeError(e.format(", ".join(missing)))
+
+    touches = np.column_stack([data['points_x_px'], data['points_y_px']])
+    targets = np.column_stack([data['location_x_px'], data['location_y_px']])
+    out = dict(data)
+    out.update(calibration.pointing_errors(touches, targets, origin))
+    return out
+
+
+def write_table(table, path=None, sep=','):
+    """Writes a table to a CSV file (or standard output).
+
+    Args:
+        table (dict): A table mapping column names to equal-length arrays.
+        path (str, optional): The path of the file to write. Defaults to None,
+            which writes to standard output.
+        sep (str, optional): The delimiter to use. Defaults to ','.
+
+    """
+    cols = list(table.keys())
+    rows = zip(*[np.asarray(table[col]).tolist() for col in cols])
+    f = io.open(path, 'w', encoding='utf-8', newline='') if path else sys.stdout
+    try:
+        writer = csv.writer(f, delimiter=sep)
+        writer.writerow(cols)
+        writer.writerows(rows)
+    finally:
+        if path:
+            f.close()
+
+
+if __name__ == "__main__":
+    write_table(aftereffects(load_data(sys.argv[1:])))
@@ -0,0 +1,111 @@
+"""Benchmarks writing trial rows with the different DataFile classes.
+
+Compares the original per-row validation and file handling against the
+compiled RowSchema encoder and the buffered/batched writers, reporting rows
+per second for each. Run from the root of the repository::
+
+    python benchmarks/bench_datafile.py
+
+"""
+import os
+import io
+import csv
+import sys
+import time
+import tempfile
+from math import nan
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sdl2.ext
+from resources import RowSchema, DataFile, BufferedDataFile
+
+# Same columns as the main experiment
+data_cols = [
+    "id", "created", "sex", "age", "handedness",
+    "block", "group", "trial_num", "response_time", "reaction_time",
+    "points_x", "points_y", "location_x", "location_y",
+    "distance_x", "distance_y", "run_time"
+]
+
+def make_row(i):
+    return {
+        "id": "P01", "created": "2023-01-01 12:00:00", "sex": "f", "age": 24,
+        "handedness": "r", "block": "Exposure", "group": "PP", "trial_num": i,
+        "response_time": 512.3456 + i, "reaction_time": 301.25,
+        "points_x": 170.123, "points_y": 95.5, "location_x": 168.0,
+        "location_y": 94.5, "distance_x": 2.123, "distance_y": 1.0,
+        "run_time": nan,
+    }
+
+
+def legacy_sanitize(header, dat):
+    # The original DataFile.write_row validation and conversion
+    for col in dat.keys():
+        if col not in header:
+            raise RuntimeError(col)
+    out = {}
+    for col in header:
+        out[col] = sdl2.ext.compat.utf8(dat[col])
+    return out
+
+def legacy_write_row(path, header, dat):
+    # The original DataFile.write_row, re-opening the file for every row
+    out = legacy_sanitize(header, dat)
+    with io.open(path, 'a', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=header, delimiter=',')
+        writer.writerow(out)
+
+
+def timed(label, n, func):
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    print("{0:<36} {1:>12,.0f} rows/s".format(label, n / elapsed))
+
+
+def main(n=20000):
+    rows = [make_row(i) for i in range(n)]
+    schema = RowSchema(data_cols)
+    tmpdir = tempfile.mkdtemp()
+    path = lambda name: os.path.join(tmpdir, name)
+
+    print("Encoding only ({0} rows)".format(n))
+    timed("  legacy validation", n, lambda: [legacy_sanitize(data_cols, r) for r in rows])
+    timed("  RowSchema.encode", n, lambda: [schema.encode(r) for r in rows])
+    timed("  RowSchema.encode_many", n, lambda: schema.encode_many(rows))
+
+    print("Writing to disk ({0} rows)".format(n))
+    def legacy():
+        DataFile(path("legacy.csv"), data_cols, sep=',')
+        for r in rows:
+            legacy_write_row(path("legacy.csv"), data_cols, r)
+    timed("  legacy DataFile.write_row", n, legacy)
+
+    def basic():
+        df = DataFile(path("basic.csv"), data_cols, sep=',')
+        for r in rows:
+            df.write_row(r)
+    timed("  DataFile.write_row", n, basic)
+
+    def buffered():
+        with BufferedDataFile(path("buffered.csv"), data_cols, sep=',') as df:
+            for r in rows:
+                df.write_row(r)
+    timed("  BufferedDataFile.write_row", n, buffered)
+
+    def batched():
+        with BufferedDataFile(path("batched.csv"), data_cols, sep=',') as df:
+            df.write_rows(rows)
+    timed("  BufferedDataFile.write_rows", n, batched)
+
+    # Make sure the new writers produce exactly the same file as before
+    with io.open(path("legacy.csv"), 'rb') as f:
+        expected = f.read()
+    for name in ("basic.csv", "buffered.csv", "batched.csv"):
+        with io.open(path(name), 'rb') as f:
+            assert f.read() == expected, name
+
+
+if __name__ == "__main__":
+    main()
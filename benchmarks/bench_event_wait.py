@@ -0,0 +1,66 @@
+"""Benchmarks busy-polling against event-driven waiting for SDL events.
+
+For each method, a background thread posts SDL user events at random
+intervals while the main thread waits for them, measuring the CPU used by
+the process and the latency between each event being posted and the main
+loop noticing it. Run from the root of the repository::
+
+    python benchmarks/bench_event_wait.py
+
+(set SDL_VIDEODRIVER=dummy to run without a display).
+
+"""
+import os
+import sys
+import time
+import random
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sdl2
+import sdl2.ext
+from resources import pump, wait_events, set_event_max_latency
+
+
+def post_events(n, sent):
+    # Posts n user events at random intervals, recording when each was sent
+    for i in range(n):
+        time.sleep(random.uniform(0.02, 0.05))
+        event = sdl2.SDL_Event()
+        event.type = sdl2.SDL_USEREVENT
+        event.user.code = i
+        sent[i] = time.perf_counter()
+        sdl2.SDL_PushEvent(event)
+
+
+def run(get_events, n=100):
+    sent = {}
+    received = {}
+    poster = threading.Thread(target=post_events, args=(n, sent))
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    poster.start()
+    while len(received) < n:
+        for event in get_events():
+            if event.type == sdl2.SDL_USEREVENT:
+                received[event.user.code] = time.perf_counter()
+    poster.join()
+    cpu = (time.process_time() - cpu_start) / (time.perf_counter() - wall_start)
+    latencies = sorted((received[i] - sent[i]) * 1000 for i in range(n))
+    return cpu, latencies
+
+
+def main():
+    sdl2.ext.init()
+    set_event_max_latency(10)
+    for label, method in [("pump() busy loop", pump), ("wait_events()", wait_events)]:
+        cpu, lat = run(method)
+        print("{0:<18} CPU {1:5.1f}%   latency mean {2:.3f} ms, p95 {3:.3f} ms, max {4:.3f} ms".format(
+            label, cpu * 100, sum(lat) / len(lat), lat[int(len(lat) * 0.95)], lat[-1]
+        ))
+    sdl2.ext.quit()
+
+
+if __name__ == "__main__":
+    main()
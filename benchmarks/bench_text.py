@@ -0,0 +1,89 @@
+"""Benchmarks the different ways of drawing a screen of text.
+
+Compares rendering each instruction screen with FontTTF.render_text and
+uploading it as a new texture (the original draw_text path) against reusing
+a texture from the TextureCache and drawing from the GlyphAtlas, reporting
+the mean time per draw for each. Run from the root of the repository::
+
+    python benchmarks/bench_text.py [font size in px]
+
+(set SDL_VIDEODRIVER=dummy to run without a display).
+
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sdl2
+import sdl2.ext
+from instructions import instructions
+from textures import TextureCache, GlyphAtlas
+
+fontpath = os.path.join("_Resources", "DejaVuSans.ttf")
+loc = (512, 384)
+
+
+def render_text(renderer, font, text):
+    # The original draw_text path: render, upload, and draw the text
+    surface = font.render_text(text, width=780, align='center')
+    tx = sdl2.ext.Texture(renderer, surface)
+    renderer.rcopy(tx, loc=loc, align=(0.5, 0.5))
+    tx.destroy()
+    sdl2.SDL_FreeSurface(surface)
+
+
+def run(renderer, draw, texts, reps=20):
+    times = []
+    for i in range(reps):
+        for text in texts:
+            renderer.clear((0, 0, 0))
+            start = time.perf_counter()
+            draw(text)
+            times.append(time.perf_counter() - start)
+            renderer.present()
+    return sum(times) / len(times) * 1000, max(times) * 1000
+
+
+def main():
+    size = sys.argv[1] if len(sys.argv) > 1 else "24"
+    sdl2.ext.init()
+    window = sdl2.ext.Window("bench_text", (1024, 768))
+    renderer = sdl2.ext.Renderer(window, flags=sdl2.SDL_RENDERER_SOFTWARE)
+    font = sdl2.ext.FontTTF(fontpath, "{0}px".format(size), (255, 255, 255))
+    texts = ["\n".join(text) for text in instructions.values()]
+
+    start = time.perf_counter()
+    atlas = GlyphAtlas(renderer, font)
+    print("Built {0}x{1} glyph atlas in {2:.1f} ms".format(
+        atlas.texture.size[0], atlas.texture.size[1], (time.perf_counter() - start) * 1000
+    ))
+    cache = TextureCache(renderer, font)
+    cache.prerender(texts, width=780, align='center')
+
+    def draw_cached(text):
+        tx = cache.get(text, width=780, align='center')
+        renderer.rcopy(tx, loc=loc, align=(0.5, 0.5))
+
+    def draw_atlas(text):
+        atlas.draw(text, loc, width=780, align='center')
+
+    def draw_atlas_uncached(text):
+        atlas._layouts.clear()
+        atlas.draw(text, loc, width=780, align='center')
+
+    methods = [
+        ("render_text + Texture", lambda text: render_text(renderer, font, text)),
+        ("TextureCache hit", draw_cached),
+        ("GlyphAtlas (new layout)", draw_atlas_uncached),
+        ("GlyphAtlas", draw_atlas),
+    ]
+    for label, draw in methods:
+        mean, worst = run(renderer, draw, texts)
+        print("{0:<24} mean {1:7.3f} ms, max {2:7.3f} ms per screen".format(label, mean, worst))
+    sdl2.ext.quit()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Benchmarks sending trigger pulses to a simulated LabJack U3.
+
+Sends a series of pulses through a U3Port backed by the u3sim device, both
+directly and through a TriggerDispatcher, and reports how long each send
+blocked the caller and how accurately the pulses were timed on the device
+(using the port changes recorded by the simulator). Run from the root of the
+repository::
+
+    python benchmarks/bench_triggers.py [latency in ms] [jitter in ms]
+
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import u3sim
+from communication import U3Port, TriggerDispatcher
+
+reps = 100
+duration = 4 # ms
+
+
+def pulse_widths(history):
+    # Gets the width of each pulse on the EIO port from the device history
+    widths = []
+    onset = None
+    for when, fio, eio, cio in history:
+        if eio and onset is None:
+            onset = when
+        elif not eio and onset is not None:
+            widths.append((when - onset) * 1000)
+            onset = None
+    return widths
+
+
+def summarize(label, blocked, widths):
+    blocked = [t * 1000 for t in blocked]
+    errors = [abs(w - duration) for w in widths]
+    print("{0:<28} send {1:6.3f} ms (max {2:6.3f}), width error {3:6.3f} ms (max {4:6.3f})".format(
+        label, sum(blocked) / len(blocked), max(blocked),
+        sum(errors) / len(errors), max(errors)
+    ))
+
+
+def run(label, device, feedback=True, dispatch=False):
+    port = U3Port(device, u3=u3sim)
+    if not feedback:
+        port._feedback = None
+    sender = TriggerDispatcher(port) if dispatch else port
+    sender.add_code('trial_start', 2)
+    device.history = []
+    blocked = []
+    for i in range(reps):
+        start = time.perf_counter()
+        sender.send('trial_start', duration)
+        blocked.append(time.perf_counter() - start)
+        time.sleep(0.01)
+    if dispatch:
+        sender.flush()
+    summarize(label, blocked, pulse_widths(device.history))
+
+
+def main():
+    latency = float(sys.argv[1]) / 1000 if len(sys.argv) > 1 else 0.001
+    jitter = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.0002
+
+    def device():
+        return u3sim.U3(latency=latency, jitter=jitter, seed=1)
+
+    run("register writes", device(), feedback=False)
+    run("feedback pulse", device())
+    run("feedback pulse (dispatcher)", device(), dispatch=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+"""Conversion between screen pixels and physical distances on the display.
+
+A `Calibration` records the resolution and physical size of the display the
+experiment window is on, so pixel coordinates (e.g. touch points and target
+locations) can be converted to millimetres without querying SDL each time.
+It is created once when the window is opened and saved to a JSON file, which
+later sessions reuse as long as the display's resolution hasn't changed. To
+use a measured screen size, edit 'size_mm' in the saved file::
+
+    {"display": 0, "resolution": [1920, 1080], "size_mm": [531.3, 298.9], ...}
+
+"""
+import os
+import io
+import json
+import time
+import ctypes
+from math import sqrt
+
+import numpy as np
+import sdl2
+
+MM_PER_INCH = 25.4
+
+
+def _desktop_resolution(display):
+    mode = sdl2.SDL_DisplayMode()
+    if sdl2.SDL_GetDesktopDisplayMode(display, ctypes.byref(mode)) != 0:
+        raise RuntimeError(
+            "Could not get the resolution of display {0}.".format(display)
+        )
+    return (mode.w, mode.h)
+
+
+def _display_dpi(display):
+    # Gets the horizontal and vertical DPI reported for a display, if any
+    ddpi, hdpi, vdpi = ctypes.c_float(0), ctypes.c_float(0), ctypes.c_float(0)
+    ret = sdl2.SDL_GetDisplayDPI(
+        display, ctypes.byref(ddpi), ctypes.byref(hdpi), ctypes.byref(vdpi)
+    )
+    if ret != 0 or hdpi.value <= 0 or vdpi.value <= 0:
+        return None
+    return (hdpi.value, vdpi.value)
+
+
+class Calibration(object):
+    """The pixel density of a display, for converting pixels to millimetres.
+
+    Args:
+        resolution (tuple): The (width, height) of the display in pixels.
+        size_mm (tuple): The physical (width, height) of the display in mm.
+        display (int, optional): The index of the display. Defaults to 0.
+        source (str, optional): Where the physical size came from (e.g.
+            'configured' or 'dpi'). Defaults to 'configured'.
+        created (str, optional): When the calibration was made. Defaults to
+            the current time.
+
+    """
+    def __init__(self, resolution, size_mm, display=0, source='configured',
+                 created=None):
+        self.resolution = tuple(int(n) for n in resolution)
+        self.size_mm = tuple(float(n) for n in size_mm)
+        self.display = display
+        self.source = source
+        self.created = created or time.strftime("%Y-%m-%d %H:%M:%S")
+
+        self.px_per_mm_x = self.resolution[0] / self.size_mm[0]
+        self.px_per_mm_y = self.resolution[1] / self.size_mm[1]
+        self.mm_per_px_x = 1.0 / self.px_per_mm_x
+        self.mm_per_px_y = 1.0 / self.px_per_mm_y
+        self._mm_per_px = np.array([self.mm_per_px_x, self.mm_per_px_y])
+
+    @classmethod
+    def from_display(cls, display=0, screensize=None, size_mm=None):
+        """Creates a calibration for a display from its current resolution.
+
+        The physical size of the display is taken from `size_mm` if given,
+        otherwise from its diagonal size in inches (`screensize`) if given
+        (assuming square pixels), otherwise from the DPI reported by SDL.
+
+        Args:
+            display (int, optional): The index of the display. Defaults to 0.
+            screensize (float, optional): The diagonal size of the display in
+                inches.
+            size_mm (tuple, optional): The physical (width, height) of the
+                display in mm.
+
+        Returns:
+            Calibration: The calibration for the display.
+
+        """
+        w, h = _desktop_resolution(display)
+        if size_mm is not None:
+            source = 'configured'
+        elif screensize is not None:
+            # Split the diagonal according to the aspect ratio of the display
+            diag_px = sqrt(w ** 2 + h ** 2)
+            diag_mm = screensize * MM_PER_INCH
+            size_mm = (diag_mm * w / diag_px, diag_mm * h / diag_px)
+            source = 'configured'
+        else:
+            dpi = _display_dpi(display)
+            if dpi is None:
+                raise RuntimeError(
+                    "Display {0} doesn't report its DPI, so its size must be "
+                    "configured.".format(display)
+                )
+            size_mm = (w / dpi[0] * MM_PER_INCH, h / dpi[1] * MM_PER_INCH)
+            source = 'dpi'
+        return cls((w, h), size_mm, display, source)
+
+    @classmethod
+    def for_window(cls, window, path=None, screensize=None, size_mm=None):
+        """Gets the calibration for the display a window is on.
+
+        If `path` is given and contains a saved calibration for the same
+        display and resolution, it is reused. Otherwise, a new calibration is
+        created (see `from_display`) and saved to `path`.
+
+        Args:
+            window (sdl2.ext.Window): The experiment window.
+            path (str, optional): The path of the saved calibration file.
+            screensize, size_mm: The configured size of the display (see
+                `from_display`).
+
+        Returns:
+            Calibration: The calibration for the window's display.
+
+        """
+        display = sdl2.SDL_GetWindowDisplayIndex(window.window)
+        if display < 0:
+            display = 0
+        if path and os.path.exists(path):
+            saved = cls.load(path)
+            if (saved.display == display and
+                    saved.resolution == _desktop_resolution(display)):
+                return saved
+        calibration = cls.from_display(display, screensize, size_mm)
+        if path:
+            calibration.save(path)
+        return calibration
+
+    @classmethod
+    def load(cls, path):
+        """Loads a calibration from a JSON file.
+
+        """
+        with io.open(path, 'r', encoding='utf-8') as f:
+            info = json.load(f)
+        return cls(
+            info['resolution'], info['size_mm'], info.get('display', 0),
+            info.get('source', 'configured'), info.get('created')
+        )
+
+    def save(self, path):
+        """Writes the calibration to a JSON file atomically.
+
+        """
+        info = {
+            'display': self.display, 'resolution': list(self.resolution),
+            'size_mm': list(self.size_mm), 'source': self.source,
+            'created': self.created,
+        }
+        tmp_path = path + ".tmp"
+        with io.open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(info, f, indent=1)
+        os.replace(tmp_path, path)
+
+    def x_to_mm(self, px):
+        """Converts horizontal pixels (a number or array) to mm.
+
+        """
+        return px * self.mm_per_px_x
+
+    def y_to_mm(self, px):
+        """Converts vertical pixels (a number or array) to mm.
+
+        """
+        return px * self.mm_per_px_y
+
+    def mm_to_px(self, mm):
+        """Converts a distance in mm to pixels (averaging the two axes).
+
+        """
+        return mm * (self.px_per_mm_x + self.px_per_mm_y) / 2.0
+
+    def to_mm(self, points):
+        """Converts an array of (x, y) pixel coordinates to mm.
+
+        Args:
+            points (array-like): An array of shape (..., 2) of pixel
+                coordinates.
+
+        Returns:
+            numpy.ndarray: The coordinates in mm.
+
+        """
+        return np.asarray(points, dtype=float) * self._mm_per_px
+
+    def to_px(self, points):
+        """Converts an array of (x, y) coordinates in mm to pixels.
+
+        Args:
+            points (array-like): An array of shape (..., 2) of coordinates in
+                mm.
+
+        Returns:
+            numpy.ndarray: The coordinates in pixels.
+
+        """
+        return np.asarray(points, dtype=float) / self._mm_per_px
+
+    def radius(self, size):
+        """Gets the radius in pixels of a circle with a given diameter in mm.
+
+        """
+        return self.mm_to_px(size) / 2.0
+
+    def pointing_errors(self, touches, targets, origin=None):
+        """Computes the pointing errors for a batch of trials at once.
+
+        Converts raw pixel touch and target locations to mm, and computes the
+        offset of each touch from its target, the radial (straight-line)
+        error, and the angular error of the reach direction. Missing touches
+        (NaN) give NaN errors.
+
+        Angles are measured from the `origin` (where reaches start), with 0
+        pointing straight up the screen and positive angles to the right, so
+        a positive angular error means the touch was clockwise of (to the
+        right of) the target.
+
+        Args:
+            touches (array-like): An (N, 2) array of touch coordinates in
+                pixels.
+            targets (array-like): An (N, 2) array of target coordinates in
+                pixels.
+            origin (tuple, optional): The (x, y) pixel coordinates reaches
+                start from. Defaults to the bottom center of the display.
+
+        Returns:
+            dict: A table of arrays, containing the touch and target locations
+            in mm ('points_x', 'points_y', 'location_x', 'location_y'), the
+            offsets ('distance_x', 'distance_y'), the 'radial_error' in mm,
+            and the 'angular_error' in degrees.
+
+        """
+        touches = np.asarray(touches, dtype=float).reshape(-1, 2)
+        targets = np.asarray(targets, dtype=float).reshape(-1, 2)
+        if origin is None:
+            origin = (self.resolution[0] / 2.0, self.resolution[1])
+        touches_mm = touches * self._mm_per_px
+        targets_mm = targets * self._mm_per_px
+        offsets = touches_mm - targets_mm
+
+        # Reach directions from the origin, with y flipped so up is positive
+        origin_mm = np.asarray(origin, dtype=float) * self._mm_per_px
+        touch_vec = touches_mm - origin_mm
+        target_vec = targets_mm - origin_mm
+        touch_angle = np.arctan2(touch_vec[:, 0], -touch_vec[:, 1])
+        target_angle = np.arctan2(target_vec[:, 0], -target_vec[:, 1])
+        angular = np.degrees(touch_angle - target_angle)
+        angular = (angular + 180.0) % 360.0 - 180.0
+
+        return {
+            'points_x': touches_mm[:, 0], 'points_y': touches_mm[:, 1],
+            'location_x': targets_mm[:, 0], 'location_y': targets_mm[:, 1],
+            'distance_x': offsets[:, 0], 'distance_y': offsets[:, 1],
+            'radial_error': np.hypot(offsets[:, 0], offsets[:, 1]),
+            'angular_error': angular,
+        }
@@ -0,0 +1,355 @@
+"""Columnar binary storage for trial data.
+
+Sessions are stored as NumPy structured arrays in ``.npy`` files, with one
+typed field per data column: float64 for measures, integers for trial numbers,
+and integer codes for categorical columns such as block and group. The
+category labels for the codes are stored in a JSON file next to the array.
+
+Because the arrays are plain ``.npy`` files, they can be memory-mapped with
+``np.load(path, mmap_mode='r')`` (or `load_session`) instead of re-parsing
+text on every analysis run.
+
+Existing CSVs written by DataFile can be converted from the command line::
+
+    python columnar.py _Data/P01/P01reach_and_point.csv
+
+"""
+import os
+import io
+import csv
+import sys
+import json
+from math import nan
+
+import numpy as np
+
+from resources import RowSchema, add_quit_hook, remove_quit_hook
+
+# Columns stored as integer codes for a list of labels (scripts with other
+# text columns pass their own list)
+CATEGORICAL_COLS = ["id", "created", "sex", "handedness", "block", "group"]
+
+# Columns stored as whole numbers
+INTEGER_COLS = ["trial_num", "block_num"]
+
+# Code used for missing values in categorical columns
+MISSING_CODE = -1
+
+# Text written to data files for missing values
+MISSING_TEXT = ['', 'nan', 'None']
+
+
+def column_kinds(header, categorical=None):
+    """Determines how each column in a data file header will be stored.
+
+    Args:
+        header (list): The names of the columns.
+        categorical (list, optional): The names of the columns to store as
+            categories. Defaults to `CATEGORICAL_COLS`.
+
+    Returns:
+        dict: A mapping of column names to 'category', 'int', or 'float'.
+
+    """
+    if categorical is None:
+        categorical = CATEGORICAL_COLS
+    kinds = {}
+    for col in header:
+        if col in categorical:
+            kinds[col] = 'category'
+        elif col in INTEGER_COLS:
+            kinds[col] = 'int'
+        else:
+            kinds[col] = 'float'
+    return kinds
+
+
+def session_dtype(header, categorical=None):
+    """Gets the NumPy structured dtype used to store a given header.
+
+    Args:
+        header (list): The names of the columns.
+        categorical (list, optional): The names of the columns to store as
+            categories. Defaults to `CATEGORICAL_COLS`.
+
+    Returns:
+        numpy.dtype: The structured dtype, with one field per column.
+
+    """
+    types = {'category': np.int16, 'int': np.int32, 'float': np.float64}
+    kinds = column_kinds(header, categorical)
+    return np.dtype([(col, types[kinds[col]]) for col in header])
+
+
+def _is_missing(value):
+    if isinstance(value, float):
+        return value != value
+    return value is None or (isinstance(value, str) and value in MISSING_TEXT)
+
+
+def _to_float(value):
+    # Converts a value to float, treating anything non-numeric as missing
+    if _is_missing(value):
+        return nan
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return nan
+
+
+def _categories_path(npy_path):
+    return os.path.splitext(npy_path)[0] + "_categories.json"
+
+
+class ColumnarDataFile(object):
+    """A DataFile-compatible class for writing trials to a structured array.
+
+    Rows are converted to typed values as they are added and the full session
+    array is saved to disk at the end of each block (and when the file is
+    closed), replacing the previous version atomically. The labels for each
+    categorical column are saved next to the array in a JSON file.
+
+    To keep writing the usual per-participant CSV as well, pass a DataFile as
+    the `mirror` and every row will be written to it too.
+
+    Args:
+        outpath (str): The path of the ``.npy`` file to create.
+        header (list): A list defining the names and order of columns for
+            the array.
+        mirror (DataFile, optional): Another DataFile to write all rows to,
+            e.g. the participant's CSV. Defaults to None.
+        categorical (list, optional): The names of the columns to store as
+            categories. Defaults to `CATEGORICAL_COLS`.
+
+    """
+    def __init__(self, outpath, header, mirror=None, categorical=None):
+        self.filepath = outpath
+        self.header = header
+        self.mirror = mirror
+        self.schema = RowSchema(header)
+        self.dtype = session_dtype(header, categorical)
+        self._kinds = column_kinds(header, categorical)
+        self._columns = {col: [] for col in header}
+        self._categories = {
+            col: [] for col in header if self._kinds[col] == 'category'
+        }
+        self._codes = {col: {} for col in self._categories}
+        self._closed = False
+        self.save()
+        add_quit_hook(self.close)
+
+    @property
+    def closed(self):
+        return self._closed
+
+    @property
+    def stats(self):
+        """dict: Writer statistics from the mirror DataFile, if any."""
+        return getattr(self.mirror, 'stats', {})
+
+    def _code(self, col, value):
+        # Gets the integer code for a categorical value, adding it if new
+        if _is_missing(value):
+            return MISSING_CODE
+        value = str(value)
+        codes = self._codes[col]
+        if value not in codes:
+            codes[value] = len(self._categories[col])
+            self._categories[col].append(value)
+        return codes[value]
+
+    def write_row(self, dat):
+        """Adds a row of data to the session array.
+
+        Args:
+            dat (dict): A dictionary with fields matching each of the column
+                names in the header.
+
+        """
+        self.write_rows([dat])
+
+    def write_rows(self, rows):
+        """Adds multiple rows of data to the session array at once.
+
+        Args:
+            rows (list): A list of dictionaries with fields matching each of
+                the column names in the header.
+
+        """
+        if self._closed:
+            raise RuntimeError("Cannot write to a closed DataFile.")
+        for dat in rows:
+            values = self.schema.values(dat)
+            # Convert the numeric values first and only add the row (and any
+            # new category labels) once they have all converted, so that a bad
+            # value never leaves the columns with different numbers of rows
+            row = []
+            for col, value in zip(self.header, values):
+                kind = self._kinds[col]
+                if kind == 'int':
+                    value = int(value)
+                elif kind == 'float':
+                    value = _to_float(value)
+                row.append(value)
+            for col, value in zip(self.header, row):
+                if self._kinds[col] == 'category':
+                    value = self._code(col, value)
+                self._columns[col].append(value)
+        if self.mirror:
+            self.mirror.write_rows(rows)
+
+    def to_array(self):
+        """Gets all rows written so far as a structured array.
+
+        Returns:
+            numpy.ndarray: The session data, with one field per column.
+
+        """
+        n = len(self._columns[self.header[0]]) if self.header else 0
+        arr = np.empty(n, dtype=self.dtype)
+        for col in self.header:
+            arr[col] = self._columns[col]
+        return arr
+
+    def save(self):
+        """Saves the session array and its categories to disk.
+
+        """
+        save_session(self.filepath, self.to_array(), self._categories)
+
+    def end_block(self):
+        """Saves the session array at the end of a block.
+
+        """
+        if not self._closed:
+            self.save()
+        if self.mirror:
+            self.mirror.end_block()
+
+    def close(self):
+        """Saves the session array and closes the file.
+
+        """
+        if self._closed:
+            return
+        self.save()
+        self._closed = True
+        remove_quit_hook(self.close)
+        if self.mirror:
+            self.mirror.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def save_session(npy_path, arr, categories):
+    """Saves a session array and its category labels to disk.
+
+    Both files are written to temporary paths first and then moved into
+    place, so a crash never leaves a half-written array.
+
+    Args:
+        npy_path (str): The path of the ``.npy`` file to write.
+        arr (numpy.ndarray): The structured session array.
+        categories (dict): A mapping of categorical column names to their
+            lists of labels, in code order.
+
+    """
+    cat_path = _categories_path(npy_path)
+    with io.open(npy_path + ".tmp", 'wb') as f:
+        np.save(f, arr, allow_pickle=False)
+    with io.open(cat_path + ".tmp", 'w', encoding='utf-8') as f:
+        json.dump(categories, f)
+    os.replace(npy_path + ".tmp", npy_path)
+    os.replace(cat_path + ".tmp", cat_path)
+
+
+def load_session(npy_path, mmap=True):
+    """Loads a session array and its category labels.
+
+    Args:
+        npy_path (str): The path of the ``.npy`` file to load.
+        mmap (bool, optional): Whether to memory-map the array read-only
+            instead of reading it all into memory. Defaults to True.
+
+    Returns:
+        tuple: The structured session array, and a dict mapping categorical
+        column names to their lists of labels (so that ``labels[code]`` gives
+        the label for a code).
+
+    """
+    arr = np.load(npy_path, mmap_mode='r' if mmap else None, allow_pickle=False)
+    with io.open(_categories_path(npy_path), 'r', encoding='utf-8') as f:
+        categories = json.load(f)
+    return arr, categories
+
+
+def decode(arr, categories, col):
+    """Converts a categorical column from codes back to labels.
+
+    Args:
+        arr (numpy.ndarray): A structured session array.
+        categories (dict): The category labels from `load_session`.
+        col (str): The name of the categorical column.
+
+    Returns:
+        numpy.ndarray: The labels for each row, with None for missing values.
+
+    """
+    labels = np.array(categories[col] + [None], dtype=object)
+    codes = np.asarray(arr[col])
+    return labels[np.where(codes == MISSING_CODE, len(categories[col]), codes)]
+
+
+def read_csv(csv_path, sep=','):
+    """Reads the header and rows of a data file written by DataFile.
+
+    Comment lines starting with '#' and blank lines above the header are
+    skipped.
+
+    Args:
+        csv_path (str): The path of the data file.
+        sep (str, optional): The delimiter used in the file. Defaults to ','.
+
+    Returns:
+        tuple: The list of column names, and a list of rows (as lists of text).
+
+    """
+    with io.open(csv_path, 'r', encoding='utf-8') as f:
+        lines = (line for line in f if line.strip() and not line.startswith('#'))
+        reader = csv.reader(lines, delimiter=sep)
+        header = next(reader, [])
+        rows = [row for row in reader]
+    return header, rows
+
+
+def convert_csv(csv_path, npy_path=None, sep=',', categorical=None):
+    """Converts a data file written by DataFile to a columnar session array.
+
+    Args:
+        csv_path (str): The path of the data file to convert.
+        npy_path (str, optional): The path of the ``.npy`` file to write.
+            Defaults to the path of the data file with a '.npy' extension.
+        sep (str, optional): The delimiter used in the file. Defaults to ','.
+        categorical (list, optional): The names of the columns to store as
+            categories. Defaults to `CATEGORICAL_COLS`.
+
+    Returns:
+        str: The path of the written ``.npy`` file.
+
+    """
+    if npy_path is None:
+        npy_path = os.path.splitext(csv_path)[0] + ".npy"
+    header, rows = read_csv(csv_path, sep)
+    out = ColumnarDataFile(npy_path, header, categorical=categorical)
+    out.write_rows([dict(zip(header, row)) for row in rows])
+    out.close()
+    return npy_path
+
+
+if __name__ == "__main__":
+    for path in sys.argv[1:]:
+        print("{0} -> {1}".format(path, convert_csv(path)))
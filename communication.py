@@ -1,4 +1,7 @@
 import time
+import atexit
+import threading
+from collections import deque, namedtuple
 from importlib.util import find_spec
 
 
@@ -10,6 +13,10 @@ LABJACK_REGISTERS = {
     'CIO': 6702, # Note: 4 pins, only supports values 0-15
 }
 
+# The order of the ports in U3 port state commands, and the pins they have
+LABJACK_PORTS = ['FIO', 'EIO', 'CIO']
+LABJACK_MASKS = {'FIO': 0xFF, 'EIO': 0xFF, 'CIO': 0x0F}
+
 def _package_available(name):
     # Checks whether a given package is installed. 
     try:
@@ -31,14 +38,23 @@ def _check_labjack_driver():
     return has_driver
 
 
-def get_trigger_port():
+def get_trigger_port(simulate=False):
     """Retrieves a TriggerPort object for writing digital trigger codes.
 
     If a supported hardware trigger port is available, it will be
     initialized and configured for sending trigger codes. If no digital
     trigger hardware is available, a virtual trigger port will be returned.
 
+    Args:
+        simulate (bool, optional): If True, use a simulated LabJack U3 (see
+            `u3sim`) instead of any hardware. Defaults to False.
+
     """
+    if simulate:
+        import u3sim
+        print("\nNOTE: Using a simulated LabJack U3 for triggers...\n")
+        return U3Port(u3sim.U3(), u3=u3sim)
+
     # Try loading the LabLack U3 as a trigger port
     if _package_available('u3'):
         import u3
@@ -61,6 +77,9 @@ class TriggerPort(object):
     def __init__(self, device):
         # NOTE: Codes may be implementation-specific to allow for preprocessing
         self.codes = {}
+        # The last value written to each port, so writes to one port can be
+        # combined with the current state of the others
+        self.state = {name: 0 for name in LABJACK_PORTS}
         self._device = device
         self._hardware_init()
 
@@ -120,9 +139,57 @@ class TriggerPort(object):
                 Defaults to 4 ms.
         
         """
-        self._write_trigger(self.codes[name])
+        self.pulse(self.codes[name], duration)
+
+    def write(self, value, port=None):
+        """Writes a value to the trigger port, leaving it set.
+
+        Args:
+            value (int): The value to write.
+            port (str, optional): The name of the hardware port to write to
+                (e.g. 'FIO'). Defaults to the trigger port's default port.
+
+        """
+        self._write_trigger(value, port)
+        self.state[port or labjack_port] = value
+
+    def write_ports(self, states):
+        """Writes values to several ports at once.
+
+        On hardware that supports it (e.g. the U3), all the ports are set in a
+        single transaction, so they change at the same time. Ports not in
+        `states` are left as they are.
+
+        Args:
+            states (dict): A dictionary in the form ``{'port': value}`` (e.g.
+                ``{'FIO': 3, 'EIO': 8}``) of the values to write.
+
+        """
+        self._write_ports(states)
+        self.state.update(states)
+
+    def pulse(self, value, duration=4, port=None, hold=None):
+        """Writes a value to the trigger port and resets it to 0 after a delay.
+
+        Args:
+            value (int): The value to write.
+            duration (int, optional): The number of milliseconds to wait between
+                writing the value and resetting the pins to 0. Defaults to 4 ms.
+            port (str, optional): The name of the hardware port to write to
+                (e.g. 'FIO'). Defaults to the trigger port's default port.
+            hold (dict, optional): Values to write to other ports at the same
+                time as the pulse (see `write_ports`), which are left set
+                after the pulse ends. Defaults to None.
+
+        """
+        port = port or labjack_port
+        states = dict(hold or {})
+        states[port] = value
+        self._write_ports(states)
         time.sleep(duration / 1000.0)
-        self._write_trigger(0)
+        self._write_trigger(0, port)
+        self.state.update(states)
+        self.state[port] = 0
 
     def close(self):
         """Closes the connection with the trigger port hardware.
@@ -138,11 +205,35 @@ class TriggerPort(object):
         # given code to the hardware.
         pass
 
+    def _write_ports(self, states):
+        # Writes values to several ports. Ports are written one at a time
+        # unless the device supports setting them together.
+        for port, value in states.items():
+            self._write_trigger(value, port)
+
 
 class U3Port(TriggerPort):
     """A TriggerPort implementation for LabJack U3 devices.
 
+    Pulses are sent as a single feedback command that sets the port, waits on
+    the device, and resets the port, so the pulse width is timed by the U3
+    rather than the host and only one USB transaction is needed. Writes to
+    several ports (including ports held during a pulse) are also made with a
+    single port state command, so all the pins change together. If feedback
+    commands aren't available or fail, these fall back to separate register
+    writes with a host-side wait.
+
+    Args:
+        device (u3.U3): The U3 device to send triggers with.
+        u3 (module, optional): The module providing the U3's feedback commands
+            (e.g. `u3sim` for a simulated device). Defaults to LabJackPython's
+            ``u3`` module.
+
     """
+    def __init__(self, device, u3=None):
+        self._u3 = u3
+        super(U3Port, self).__init__(device)
+
     def _hardware_init(self):
         self._write_reg = LABJACK_REGISTERS[labjack_port]
         self._device.getCalibrationData()
@@ -152,6 +243,91 @@ class U3Port(TriggerPort):
             EIODirection=255, EIOState=0, EIOAnalog=0,
             CIODirection=255, CIOState=0,
         )
+        self._init_feedback()
+
+    def _init_feedback(self):
+        # Gets the feedback commands used for device-timed pulses, if supported
+        if self._u3 is None:
+            import u3
+            self._u3 = u3
+        u3 = self._u3
+        self._feedback = None
+        if all(hasattr(u3, cmd) for cmd in ('PortStateWrite', 'WaitShort', 'WaitLong')):
+            self._feedback = (u3.PortStateWrite, u3.WaitShort, u3.WaitLong)
+        # Older (pre-1.30) U3 hardware has half-length wait units
+        self._wait_short = 128e-6
+        self._wait_long = 32e-3
+        try:
+            if float(getattr(self._device, 'hardwareVersion', 1.3)) < 1.3:
+                self._wait_short = 64e-6
+                self._wait_long = 16e-3
+        except (TypeError, ValueError):
+            pass
+
+    def _wait_commands(self, duration):
+        # Splits a wait (in ms) into WaitLong and WaitShort feedback commands
+        _, WaitShort, WaitLong = self._feedback
+        seconds = duration / 1000.0
+        cmds = []
+        long_units = min(int(seconds / self._wait_long), 255)
+        if long_units:
+            cmds.append(WaitLong(long_units))
+            seconds -= long_units * self._wait_long
+        short_units = min(int(round(seconds / self._wait_short)), 255)
+        if short_units:
+            cmds.append(WaitShort(short_units))
+        return cmds
+
+    def _port_state(self, states):
+        # Builds the (FIO, EIO, CIO) state and write mask for a port state
+        # command, so that only the given ports are changed
+        state = [0, 0, 0]
+        mask = [0, 0, 0]
+        for port, value in states.items():
+            index = LABJACK_PORTS.index(port)
+            mask[index] = LABJACK_MASKS[port]
+            state[index] = value & mask[index]
+        return state, mask
+
+    def _feedback_write(self, cmds):
+        # Sends a list of feedback commands in one transaction, disabling
+        # feedback commands if they fail
+        try:
+            self._device.getFeedback(*cmds)
+            return True
+        except Exception as e:
+            print("\nNOTE: U3 feedback commands failed ({0}), using register "
+                "writes instead...\n".format(e))
+            self._feedback = None
+            return False
+
+    def _write_ports(self, states):
+        if self._feedback and len(states) > 1:
+            PortStateWrite = self._feedback[0]
+            state, mask = self._port_state(states)
+            if self._feedback_write([PortStateWrite(State=state, WriteMask=mask)]):
+                return
+        TriggerPort._write_ports(self, states)
+
+    def pulse(self, value, duration=4, port=None, hold=None):
+        if not self._feedback:
+            return TriggerPort.pulse(self, value, duration, port, hold)
+
+        # Set the pulse and any held ports together, wait on the device, and
+        # then reset only the pulsed port
+        PortStateWrite = self._feedback[0]
+        port = port or labjack_port
+        states = dict(hold or {})
+        states[port] = value
+        state, mask = self._port_state(states)
+        _, reset_mask = self._port_state({port: 0})
+        cmds = [PortStateWrite(State=state, WriteMask=mask)]
+        cmds += self._wait_commands(duration)
+        cmds.append(PortStateWrite(State=[0, 0, 0], WriteMask=reset_mask))
+        if not self._feedback_write(cmds):
+            return TriggerPort.pulse(self, value, duration, port, hold)
+        self.state.update(states)
+        self.state[port] = 0
 
     def _write_trigger(self, value, port = None):
         port_reg = self._write_reg
@@ -173,3 +349,216 @@ class VirtualPort(TriggerPort):
     def _hardware_init(self):
         print("\nNOTE: No hardware trigger device, using virtual triggers...\n")
 
+
+
+# A write made by a TriggerDispatcher: the name of the trigger (None for raw
+# writes), the value and port written (for writes to several ports, a dict of
+# the values and None), and when the write was requested, started, and
+# finished (on the perf_counter clock, in seconds)
+TriggerWrite = namedtuple(
+    'TriggerWrite', ['name', 'value', 'port', 'requested', 'start', 'end']
+)
+
+# Tells the dispatcher thread to stop
+_STOP = object()
+
+
+class TriggerDispatcher(object):
+    """Sends trigger codes from a background thread so sending never blocks.
+
+    Wraps a TriggerPort and provides the same ``send`` method (with the same
+    code names), but instead of writing the code, waiting for the pulse
+    duration and resetting the pins on the calling thread, ``send`` just
+    queues the pulse and returns immediately. A dispatcher thread performs the
+    queued writes in order, and records when each write actually happened in
+    `writes`. Writes that fail are skipped and recorded in `errors`.
+
+    Since trigger hardware can't safely be accessed from two threads at once,
+    all other writes to the port (e.g. for the goggles) should also go through
+    the dispatcher using `write` or `write_ports`, or be held during a pulse
+    with ``send(name, hold=...)``.
+
+    If a `log` (e.g. a triggerlog.TriggerLog) is set, every write is also
+    recorded in it, tagged with the trial that was current when the write was
+    requested.
+
+    Args:
+        port (TriggerPort): The trigger port to send codes with.
+        log_size (int, optional): The number of most recent writes to keep in
+            `writes`. Defaults to 10000.
+        log (triggerlog.TriggerLog, optional): A log to record every write
+            in. Can also be set later with the `log` attribute. Defaults to
+            None.
+
+    """
+    def __init__(self, port, log_size=10000, log=None):
+        self.port = port
+        self.log = log
+        self.writes = deque(maxlen=log_size)
+        self.errors = [] # (name, value, port, requested, exception)
+        self._pending = deque()
+        self._wake = threading.Event()
+        self._done = threading.Condition()
+        self._submitted = 0
+        self._completed = 0
+        self._closed = False
+        self._thread = threading.Thread(
+            target=self._run, name="TriggerDispatcher", daemon=True
+        )
+        self._thread.start()
+        atexit.register(self.close)
+
+    @property
+    def codes(self):
+        return self.port.codes
+
+    @property
+    def state(self):
+        # NOTE: Only includes writes the dispatcher thread has performed
+        return self.port.state
+
+    def add_code(self, name, value):
+        """Adds a new code to the list of triggers (see TriggerPort.add_code).
+
+        """
+        self.port.add_code(name, value)
+
+    def add_codes(self, mapping):
+        """Adds a set of codes to the list of triggers (see
+        TriggerPort.add_codes).
+
+        """
+        self.port.add_codes(mapping)
+
+    def _submit(self, item):
+        if self._closed:
+            raise RuntimeError("Cannot send triggers after the dispatcher is closed.")
+        trial = (self.log.block_num, self.log.trial_num) if self.log else None
+        self._submitted += 1
+        self._pending.append(item + (trial,))
+        self._wake.set()
+
+    def send(self, name, duration=4, hold=None):
+        """Queues a trigger pulse and returns immediately.
+
+        The dispatcher thread writes the requested trigger code, waits the
+        given duration, and then resets the trigger pins to 0.
+
+        Args:
+            name (str): The name of the trigger code to write to the port.
+            duration (int, optional): The number of milliseconds to wait between
+                writing the trigger code and resetting the trigger pins to 0.
+                Defaults to 4 ms.
+            hold (dict, optional): Values to write to other ports at the same
+                time as the trigger code (e.g. ``{'FIO': 3}`` to close the
+                goggles), which stay set after the pulse. Defaults to None.
+
+        """
+        value = self.port.codes[name]
+        self._submit((name, value, None, duration, hold, time.perf_counter()))
+
+    def write(self, value, port=None):
+        """Queues a single write of a value to the trigger port.
+
+        Args:
+            value (int): The value to write.
+            port (str, optional): The name of the hardware port to write to
+                (e.g. 'FIO'). Defaults to the trigger port's default port.
+
+        """
+        self._submit((None, value, port, None, None, time.perf_counter()))
+
+    def write_ports(self, states):
+        """Queues a write of values to several ports at once (see
+        TriggerPort.write_ports).
+
+        Args:
+            states (dict): A dictionary in the form ``{'port': value}`` of the
+                values to write.
+
+        """
+        states = dict(states)
+        self._submit((None, states, None, None, None, time.perf_counter()))
+
+    def _write(self, name, value, port, requested, trial):
+        start = time.perf_counter_ns()
+        if isinstance(value, dict):
+            self.port.write_ports(value)
+        else:
+            self.port.write(value, port)
+        end = time.perf_counter_ns()
+        self.writes.append(
+            TriggerWrite(name, value, port, requested, start / 1e9, end / 1e9)
+        )
+        if self.log:
+            states = value if isinstance(value, dict) else {port or labjack_port: value}
+            for p, v in states.items():
+                self.log.record('write', v, p, start, end, trial=trial)
+
+    def _pulse(self, name, value, port, duration, hold, requested, trial):
+        # Pulses are recorded as a single write from when the code was
+        # written until the pins were reset
+        start = time.perf_counter_ns()
+        self.port.pulse(value, duration, port, hold)
+        end = time.perf_counter_ns()
+        self.writes.append(
+            TriggerWrite(name, value, port, requested, start / 1e9, end / 1e9)
+        )
+        if self.log:
+            self.log.record('pulse', value, port or labjack_port, start, end, duration, trial)
+            for p, v in (hold or {}).items():
+                self.log.record('hold', v, p, start, end, trial=trial)
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            while self._pending:
+                item = self._pending.popleft()
+                if item is _STOP:
+                    return
+                name, value, port, duration, hold, requested, trial = item
+                try:
+                    if duration is None:
+                        self._write(name, value, port, requested, trial)
+                    else:
+                        self._pulse(name, value, port, duration, hold, requested, trial)
+                except Exception as e:
+                    # Keep going if a write fails (e.g. the device was briefly
+                    # disconnected), so later triggers are still sent
+                    if not self.errors:
+                        print("\nNOTE: Trigger write failed ({0})\n".format(e))
+                    self.errors.append((name, value, port, requested, e))
+                with self._done:
+                    self._completed += 1
+                    self._done.notify_all()
+
+    def flush(self, timeout=None):
+        """Waits until all queued writes have been performed.
+
+        Args:
+            timeout (float, optional): The longest time to wait, in seconds.
+                Defaults to None (wait indefinitely).
+
+        Returns:
+            bool: True if all writes were performed, or False if timed out.
+
+        """
+        target = self._submitted
+        with self._done:
+            return self._done.wait_for(
+                lambda: self._completed >= target or not self._thread.is_alive(),
+                timeout
+            ) and self._completed >= target
+
+    def close(self):
+        """Performs any queued writes and then closes the trigger port.
+
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._pending.append(_STOP)
+        self._wake.set()
+        self._thread.join()
+        self.port.close()
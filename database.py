@@ -0,0 +1,226 @@
+import os
+import sqlite3
+
+from resources import RowSchema, add_quit_hook, remove_quit_hook
+
+# Columns to index for fast queries across participants, if present
+INDEX_COLUMNS = ['id', 'group', 'block', 'trial_num']
+
+
+def _quote(name):
+    # Quotes a column or table name for use in SQL (e.g. 'group' is a keyword)
+    return '"{0}"'.format(name.replace('"', '""'))
+
+
+def connect(db_path):
+    """Opens a connection to a trial database in WAL mode.
+
+    WAL (write-ahead log) mode allows analysis tools to read from the database
+    while an experiment session is writing to it.
+
+    Args:
+        db_path (str): The path of the SQLite database file.
+
+    Returns:
+        sqlite3.Connection: The database connection.
+
+    """
+    db = sqlite3.connect(db_path, isolation_level=None)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    return db
+
+
+class SQLiteDataFile(object):
+    """A DataFile-compatible class for writing trials to a SQLite database.
+
+    Trials from all participants are written to a single table in a shared
+    database, with indexes on the participant, group, block, and trial number
+    columns so that study-wide queries don't need to re-read any CSVs. Rows are
+    added within a transaction that is committed at the end of each block
+    (and when the file is closed), so a block's trials are stored together.
+
+    Like a regular DataFile, any existing data for the session is replaced
+    when it is created: all rows matching the given `key` (e.g. the
+    participant's ID) are deleted.
+
+    If the table already exists (e.g. created by another version of the
+    experiment), any columns of the header it doesn't have are added to it.
+    Columns the header doesn't have are left empty for the new rows.
+
+    To keep writing the usual per-participant CSV as well, pass a DataFile as
+    the `mirror` and every row will be written to it too.
+
+    Args:
+        db_path (str): The path of the SQLite database file. Will be created
+            if it doesn't already exist.
+        header (list): A list defining the names and order of columns for
+            the table.
+        table (str, optional): The name of the table to write trials to.
+            Defaults to 'trials'.
+        key (dict, optional): Column values identifying the session (e.g.
+            ``{'id': 'P01'}``), whose existing rows are replaced. Defaults to
+            None (no rows are replaced).
+        mirror (DataFile, optional): Another DataFile to write all rows to,
+            e.g. the participant's CSV. Defaults to None.
+
+    """
+    def __init__(self, db_path, header, table='trials', key=None, mirror=None):
+        self.filepath = db_path
+        self.header = header
+        self.table = table
+        self.mirror = mirror
+        self.schema = RowSchema(header)
+        self._db = connect(db_path)
+        self._in_block = False
+        self._create(key)
+        add_quit_hook(self.close)
+
+    def _create(self, key):
+        # Create the trials table and indexes if they don't already exist
+        cols = ", ".join(_quote(col) for col in self.header)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS {0} ({1})".format(_quote(self.table), cols)
+        )
+        existing = set(r[1].lower() for r in self._db.execute(
+            "PRAGMA table_info({0})".format(_quote(self.table))
+        ))
+        for col in self.header:
+            # NOTE: SQLite column names aren't case-sensitive
+            if col.lower() in existing:
+                continue
+            try:
+                self._db.execute("ALTER TABLE {0} ADD COLUMN {1}".format(
+                    _quote(self.table), _quote(col)
+                ))
+            except sqlite3.DatabaseError as err:
+                e = "Could not add column '{0}' to table '{1}' in '{2}' ({3})."
+                raise RuntimeError(e.format(col, self.table, self.filepath, err))
+            existing.add(col.lower())
+        for col in INDEX_COLUMNS:
+            if col in self.header:
+                idx = "idx_{0}_{1}".format(self.table, col)
+                self._db.execute("CREATE INDEX IF NOT EXISTS {0} ON {1} ({2})".format(
+                    _quote(idx), _quote(self.table), _quote(col)
+                ))
+
+        # Replace any existing rows for the session
+        if key:
+            where = " AND ".join("{0} = ?".format(_quote(col)) for col in key.keys())
+            self._db.execute(
+                "DELETE FROM {0} WHERE {1}".format(_quote(self.table), where),
+                list(key.values())
+            )
+
+        # Name the columns, since the table's columns may be in another order
+        placeholders = ", ".join(["?"] * len(self.header))
+        self._insert = "INSERT INTO {0} ({1}) VALUES ({2})".format(
+            _quote(self.table), cols, placeholders
+        )
+
+    @property
+    def closed(self):
+        return self._db is None
+
+    @property
+    def stats(self):
+        """dict: Writer statistics from the mirror DataFile, if any."""
+        return getattr(self.mirror, 'stats', {})
+
+    def write_row(self, dat):
+        """Adds a row of data to the database.
+
+        Args:
+            dat (dict): A dictionary with fields matching each of the column
+                names in the header.
+
+        """
+        self.write_rows([dat])
+
+    def write_rows(self, rows):
+        """Adds multiple rows of data to the database at once.
+
+        Args:
+            rows (list): A list of dictionaries with fields matching each of
+                the column names in the header.
+
+        """
+        if self._db is None:
+            raise RuntimeError("Cannot write to a closed DataFile.")
+        # Validate rows the same way as a regular DataFile, but keep the
+        # values' original types so numbers are stored as numbers
+        values = [self.schema.values(dat) for dat in rows]
+        if not self._in_block:
+            self._db.execute("BEGIN")
+            self._in_block = True
+        self._db.executemany(self._insert, values)
+        if self.mirror:
+            self.mirror.write_rows(rows)
+
+    def end_block(self):
+        """Commits all rows written since the last block to the database.
+
+        """
+        if self._db is not None and self._in_block:
+            self._db.execute("COMMIT")
+            self._in_block = False
+        if self.mirror:
+            self.mirror.end_block()
+
+    def close(self):
+        """Commits any remaining rows and closes the database.
+
+        """
+        if self._db is None:
+            return
+        self.end_block()
+        self._db.close()
+        self._db = None
+        remove_quit_hook(self.close)
+        if self.mirror:
+            self.mirror.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def query_trials(db_path, columns=None, table='trials', **where):
+    """Retrieves trials from a trial database.
+
+    For example, to get the post-test horizontal errors for one group::
+
+       query_trials(
+           '_Data/study.sqlite', ['id', 'trial_num', 'distance_x'],
+           group='PP', block='PostTest'
+       )
+
+    Args:
+        db_path (str): The path of the SQLite database file.
+        columns (list, optional): The columns to retrieve. Defaults to all
+            columns.
+        table (str, optional): The name of the table to query. Defaults to
+            'trials'.
+        **where: Column values that retrieved rows must match.
+
+    Returns:
+        list: A list of dicts, one per trial, in the order they were written.
+
+    """
+    if not os.path.exists(db_path):
+        raise IOError("No trial database found at '{0}'".format(db_path))
+    db = connect(db_path)
+    db.row_factory = sqlite3.Row
+    try:
+        cols = ", ".join(_quote(col) for col in columns) if columns else "*"
+        sql = "SELECT {0} FROM {1}".format(cols, _quote(table))
+        if where:
+            sql += " WHERE " + " AND ".join(
+                "{0} = ?".format(_quote(col)) for col in where.keys()
+            )
+        sql += " ORDER BY rowid"
+        return [dict(row) for row in db.execute(sql, list(where.values()))]
+    finally:
+        db.close()
@@ -0,0 +1,145 @@
+import io
+import os
+import json
+import zlib
+import struct
+
+# Each record is a 4-byte length and a 4-byte CRC32 of the payload, followed
+# by the payload itself (UTF-8 encoded JSON)
+_RECORD_HEADER = struct.Struct('<II')
+
+
+def _encode_record(record):
+    payload = json.dumps(record, separators=(',', ':')).encode('utf-8')
+    crc = zlib.crc32(payload) & 0xFFFFFFFF
+    return _RECORD_HEADER.pack(len(payload), crc) + payload
+
+
+def read_journal(path):
+    """Reads all intact records from a session journal.
+
+    Records are read in order until the end of the file or the first record
+    that is truncated or fails its checksum (e.g. a partial write from a
+    crash), at which point reading stops.
+
+    Args:
+        path (str): The path of the journal file to read.
+
+    Returns:
+        tuple: A list of the intact records (as dicts), and the number of bytes
+        of the file they occupy.
+
+    """
+    records = []
+    valid_len = 0
+    if not os.path.exists(path):
+        return records, valid_len
+
+    with io.open(path, 'rb') as f:
+        data = f.read()
+
+    offset = 0
+    while offset + _RECORD_HEADER.size <= len(data):
+        length, crc = _RECORD_HEADER.unpack_from(data, offset)
+        start = offset + _RECORD_HEADER.size
+        payload = data[start:start + length]
+        if len(payload) < length or (zlib.crc32(payload) & 0xFFFFFFFF) != crc:
+            break
+        try:
+            records.append(json.loads(payload.decode('utf-8')))
+        except ValueError:
+            break
+        offset = start + length
+        valid_len = offset
+
+    return records, valid_len
+
+
+class Journal(object):
+    """An append-only, crash-recoverable log of session progress.
+
+    Each record is written as a length-prefixed, checksummed blob and flushed
+    immediately, so that if the experiment crashes the journal can be read
+    back up to the last complete record with `read_journal`.
+
+    Records are dicts with a 'type' field, e.g. 'session' for the participant
+    info at the start of the session, 'trial' for each completed trial, and
+    'complete' when the session finishes.
+
+    Args:
+        path (str): The path of the journal file.
+        resume (bool, optional): If True, append to an existing journal
+            (dropping any corrupt records at its end). If False, any existing
+            journal at the path is replaced. Defaults to False.
+        fsync (bool, optional): Whether to ask the OS to commit each record to
+            disk (``os.fsync``) as it is written. Defaults to False, which
+            protects against the experiment crashing but not the OS.
+
+    """
+    def __init__(self, path, resume=False, fsync=False):
+        self.path = path
+        self.fsync = fsync
+        if resume:
+            # Drop any partially-written record left over from a crash
+            records, valid_len = read_journal(path)
+            self._file = io.open(path, 'ab')
+            self._file.truncate(valid_len)
+        else:
+            self._file = io.open(path, 'wb')
+
+    def append(self, record_type, **fields):
+        """Appends a record to the journal.
+
+        Args:
+            record_type (str): The type of record (e.g. 'trial').
+            **fields: The contents of the record. Must be JSON-serializable.
+
+        """
+        if self._file is None:
+            raise RuntimeError("Cannot append to a closed Journal.")
+        record = {'type': record_type}
+        record.update(fields)
+        self._file.write(_encode_record(record))
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        """Closes the journal file.
+
+        """
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def get_progress(records):
+    """Summarizes how far a session got from its journal records.
+
+    Args:
+        records (list): Records from `read_journal`.
+
+    Returns:
+        tuple: The participant info dict from the 'session' record (or None),
+        a list of the data rows from all completed trials in order, and a
+        dict mapping each block number to the number of trials completed in
+        it.
+
+    """
+    info = None
+    rows = []
+    progress = {}
+    for record in records:
+        if record['type'] == 'session':
+            info = record['info']
+        elif record['type'] == 'trial':
+            rows.append(record['data'])
+            progress[record['block_num']] = record['data']['trial_num']
+    return info, rows, progress
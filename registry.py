@@ -0,0 +1,153 @@
+import os
+import io
+import json
+import time
+
+# Session statuses
+STARTED = 'started'
+COMPLETED = 'completed'
+ABORTED = 'aborted'
+UNKNOWN = 'unknown' # Data folders that existed before the registry
+
+
+def _now():
+    return time.strftime("%Y-%m-%d %H:%M:%S")
+
+
+class Registry(object):
+    """An on-disk index of all participants run in the study.
+
+    The registry records each participant's group, session status (started,
+    completed, or aborted) and timestamps in a single JSON file, so checking
+    whether an ID has already been used doesn't require scanning the data
+    folder. Every change is written to a temporary file and then moved into
+    place, so the registry is never left half-written.
+
+    If the registry file doesn't exist yet, it is created from any existing
+    participant folders in the data folder, with their status set to
+    'unknown'.
+
+    Args:
+        path (str): The path of the registry file.
+        data_dir (str, optional): The data folder to build a new registry from.
+            Defaults to the folder containing the registry file.
+
+    """
+    def __init__(self, path, data_dir=None):
+        self.path = path
+        self.participants = {}
+        if os.path.exists(path):
+            self.reload()
+        else:
+            if data_dir is None:
+                data_dir = os.path.dirname(path) or '.'
+            self._bootstrap(data_dir)
+
+    def _bootstrap(self, data_dir):
+        # Add any participant folders created before the registry existed
+        if os.path.isdir(data_dir):
+            for entry in os.scandir(data_dir):
+                if entry.is_dir() and not entry.name.startswith('.'):
+                    self.participants[entry.name] = {
+                        'group': None, 'status': UNKNOWN, 'created': None,
+                        'updated': _now(),
+                    }
+        self.save()
+
+    def reload(self):
+        """Reads the latest contents of the registry file.
+
+        """
+        with io.open(self.path, 'r', encoding='utf-8') as f:
+            self.participants = json.load(f)['participants']
+
+    def save(self):
+        """Writes the registry to disk atomically.
+
+        """
+        tmp_path = self.path + ".tmp"
+        with io.open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'participants': self.participants}, f, indent=1)
+        os.replace(tmp_path, self.path)
+
+    def exists(self, participant_id):
+        """Checks whether a participant ID has already been used.
+
+        Args:
+            participant_id (str): The ID to check.
+
+        Returns:
+            bool: True if the ID is in the registry, otherwise False.
+
+        """
+        return participant_id in self.participants
+
+    def get(self, participant_id):
+        """Gets the registry entry for a participant.
+
+        Args:
+            participant_id (str): The ID of the participant.
+
+        Returns:
+            dict: The participant's 'group', 'status', and timestamps, or None
+            if the ID isn't in the registry.
+
+        """
+        return self.participants.get(participant_id)
+
+    def start(self, participant_id, group=None, created=None):
+        """Records that a participant's session has started.
+
+        If the participant is already in the registry (e.g. when resuming a
+        session), their entry is updated rather than replaced.
+
+        Args:
+            participant_id (str): The ID of the participant.
+            group (str, optional): The participant's group.
+            created (str, optional): When the participant was created.
+                Defaults to the current time.
+
+        """
+        now = _now()
+        entry = self.participants.setdefault(participant_id, {})
+        entry.update({
+            'group': group or entry.get('group'),
+            'status': STARTED,
+            'created': entry.get('created') or created or now,
+            'updated': now,
+        })
+        self.save()
+
+    def set_status(self, participant_id, status):
+        """Updates the status of a participant's session.
+
+        Args:
+            participant_id (str): The ID of the participant.
+            status (str): The new status (e.g. 'completed' or 'aborted').
+
+        """
+        entry = self.participants.setdefault(participant_id, {'group': None})
+        entry['status'] = status
+        entry['updated'] = _now()
+        if status == COMPLETED:
+            entry['completed'] = entry['updated']
+        self.save()
+
+    def group_counts(self, status=None):
+        """Counts the number of participants in each group.
+
+        Args:
+            status (str, optional): Only count participants whose session has
+                this status (e.g. 'completed'). Defaults to None, which counts
+                all participants.
+
+        Returns:
+            dict: The number of participants in each group.
+
+        """
+        counts = {}
+        for entry in self.participants.values():
+            if status is None or entry.get('status') == status:
+                group = entry.get('group')
+                counts[group] = counts.get(group, 0) + 1
+        return counts
@@ -2,6 +2,10 @@ import os
 import io
 import csv
 import sys
+import ctypes
+import queue
+import atexit
+import threading
 
 import sdl2
 import sdl2.ext
@@ -11,6 +15,37 @@ from math import sqrt
 from PIL import Image
 from aggdraw import Draw
 
+# Functions to call before exiting when the participant or investigator quits
+_quit_hooks = []
+
+def add_quit_hook(func):
+    """Registers a function to be called before quitting on a quit event
+
+    Quit hooks are called in the order they were added, before SDL is shut
+    down and the program exits. They are used to make sure no data is lost
+    when quitting mid-session (e.g. writing out any queued rows).
+
+    Parameters
+    ----------
+    func: callable
+        A function taking no arguments
+    """
+
+    if func not in _quit_hooks:
+        _quit_hooks.append(func)
+
+def remove_quit_hook(func):
+    """Removes a function previously added with add_quit_hook
+
+    Parameters
+    ----------
+    func: callable
+        The function to remove
+    """
+
+    if func in _quit_hooks:
+        _quit_hooks.remove(func)
+
 def pump():
     """Gets events
     
@@ -23,6 +58,95 @@ def pump():
     sdl2.SDL_PumpEvents()
     return sdl2.ext.get_events()
 
+def peek_events():
+    """Gets queued events without removing them from the queue
+
+    Returns
+    -------
+    list
+        A list of the sdl2 events currently in the queue
+    """
+
+    sdl2.SDL_PumpEvents()
+    n = sdl2.SDL_PeepEvents(None, 0, sdl2.SDL_PEEKEVENT, sdl2.SDL_FIRSTEVENT, sdl2.SDL_LASTEVENT)
+    if n <= 0:
+        return []
+    events = (sdl2.SDL_Event * n)()
+    n = sdl2.SDL_PeepEvents(events, n, sdl2.SDL_PEEKEVENT, sdl2.SDL_FIRSTEVENT, sdl2.SDL_LASTEVENT)
+    return list(events[:max(n, 0)])
+
+# Longest time (in ms) wait_events will block before returning with no events
+event_max_latency = 10
+
+def set_event_max_latency(ms):
+    """Sets the longest time wait_events will block without any events
+
+    Lower values make loops that also check the clock (e.g. for timeouts)
+    notice the time sooner, at the cost of waking up the CPU more often.
+    Events themselves are always returned as soon as they arrive.
+
+    Parameters
+    ----------
+    ms: int
+        The maximum latency in milliseconds
+    """
+
+    global event_max_latency
+    event_max_latency = max(0, int(ms))
+
+def wait_events(timeout = None):
+    """Waits for events without busy-polling
+
+    Sleeps until at least one event arrives or the timeout passes, then
+    returns all queued events. Unlike calling pump() in a loop, this lets the
+    CPU idle between events instead of spinning at 100%.
+
+    Parameters
+    ----------
+    timeout: int, optional
+        The longest time to wait for an event in milliseconds. Defaults to
+        the maximum latency set with set_event_max_latency.
+    
+    Returns
+    -------
+    list
+        A list of sdl2 events (empty if the timeout passed)
+    """
+
+    if timeout is None:
+        timeout = event_max_latency
+    event = sdl2.SDL_Event()
+    if sdl2.SDL_WaitEventTimeout(ctypes.byref(event), int(timeout)) == 0:
+        return []
+    return [event] + sdl2.ext.get_events()
+
+def find_event(events, event_type, key = None):
+    """Finds the first event of a given type in a list of events
+
+    Parameters
+    ----------
+    events: list
+        A list of sdl2 events
+    event_type: int
+        The SDL event type to look for (e.g. sdl2.SDL_KEYUP)
+    key: str, optional
+        For key events, the name of the key to look for (e.g. 'space')
+    
+    Returns
+    -------
+    sdl2.SDL_Event
+        The first matching event, or None if there isn't one
+    """
+
+    keycode = None
+    if key:
+        keycode = sdl2.SDL_GetKeyFromName(key.encode('utf-8'))
+    for event in events:
+        if event.type == event_type:
+            if keycode is None or event.key.keysym.sym == keycode:
+                return event
+    return None
+
 def check_for_quit(queue):
     """Checks for quit events
     
@@ -47,6 +171,8 @@ def check_for_quit(queue):
                 break
 
     if quitting:
+        for hook in list(_quit_hooks):
+            hook()
         sdl2.ext.quit()
         sys.exit()
 
@@ -185,6 +311,148 @@ def get_mm(pixels, screensize = 24):
     mm = pixels*(screensize/display_d)*2.54*10
     return mm
 
+def _to_text(value):
+    # Converts a single value to unicode text, matching sdl2.ext.compat.utf8
+    if type(value) is str:
+        return value
+    elif isinstance(value, bytes):
+        return value.decode('utf-8')
+    return str(value)
+
+class RowSchema(object):
+    """A compiled description of the columns in a data file.
+
+    The schema is built once from the list of column names and turns rows
+    (dicts) into lists of text values in column order. Compiling the columns
+    up front means each row only needs a single lookup per column, instead of
+    searching the header for every key.
+
+    Args:
+        columns (list): A list defining the names and order of the columns.
+        types (dict, optional): A mapping of column names to types (e.g.
+            ``{'trial_num': int}``). Values in these columns are converted to
+            the given type before being formatted, raising an error if they
+            can't be.
+        formats (dict, optional): A mapping of column names to either format
+            specifications (e.g. ``'.3f'``) or functions returning text, used
+            to format the values in those columns. By default, values are
+            converted to text with ``str``.
+        na_rep (str, optional): If provided, the text to write for missing
+            values (None or NaN) in all columns, bypassing the column's type and
+            format. Defaults to None, which formats missing values like any
+            other value (e.g. 'nan').
+
+    """
+    def __init__(self, columns, types=None, formats=None, na_rep=None):
+        self.columns = list(columns)
+        self.index = {col: i for i, col in enumerate(self.columns)}
+        self.types = types or {}
+        self.formats = formats or {}
+        self.na_rep = na_rep
+
+        for col in list(self.types) + list(self.formats):
+            if col not in self.index:
+                e = "'{0}' has a type or format but is not a column in the schema."
+                raise ValueError(e.format(col))
+
+        self._encoders = [self._compile(col) for col in self.columns]
+        self._plain = self.na_rep is None and not (self.types or self.formats)
+
+    def _compile(self, col):
+        # Builds the function used to turn values in a column into text
+        coerce = self.types.get(col, None)
+        fmt = self.formats.get(col, None)
+        if fmt is None:
+            fmt_func = _to_text
+        elif callable(fmt):
+            fmt_func = fmt
+        else:
+            fmt_func = lambda value: format(value, fmt)
+
+        if coerce is None:
+            encode = fmt_func
+        else:
+            def encode(value):
+                try:
+                    value = coerce(value)
+                except (TypeError, ValueError):
+                    e = "Value {0!r} for column '{1}' is not a valid {2}."
+                    raise RuntimeError(e.format(value, col, coerce.__name__))
+                return fmt_func(value)
+
+        if self.na_rep is None:
+            return encode
+        na_rep = self.na_rep
+        def encode_na(value):
+            if value is None or (type(value) is float and value != value):
+                return na_rep
+            return encode(value)
+        return encode_na
+
+    def values(self, dat):
+        """Gets the values for each column of a row, in column order.
+
+        Args:
+            dat (dict): A dictionary with fields matching each of the columns
+                in the schema.
+
+        Returns:
+            list: The unformatted values for each column.
+
+        Raises:
+            RuntimeError: If the row is missing a column or has a field that
+                isn't a column in the schema.
+
+        """
+        try:
+            values = [dat[col] for col in self.columns]
+        except KeyError:
+            values = None
+        if values is None or len(dat) != len(self.columns):
+            # Report columns that aren't in the header first, then missing ones
+            for col in dat.keys():
+                if col not in self.index:
+                    e = "'{0}' exists in row data but not data file header."
+                    raise RuntimeError(e.format(col))
+            e = "No value for column '{0}' provided."
+            raise RuntimeError(e.format(self._missing(dat)))
+        return values
+
+    def _missing(self, dat):
+        for col in self.columns:
+            if col not in dat:
+                return col
+
+    def encode(self, dat):
+        """Converts a row of data to a list of text values in column order.
+
+        Args:
+            dat (dict): A dictionary with fields matching each of the columns
+                in the schema.
+
+        Returns:
+            list: The formatted values for each column.
+
+        """
+        values = self.values(dat)
+        if self._plain:
+            return [v if type(v) is str else _to_text(v) for v in values]
+        return [f(v) for f, v in zip(self._encoders, values)]
+
+    def encode_many(self, rows):
+        """Converts a list of rows to lists of text values in column order.
+
+        Args:
+            rows (list): A list of dictionaries with fields matching each of
+                the columns in the schema.
+
+        Returns:
+            list: The formatted values for each row.
+
+        """
+        encode = self.encode
+        return [encode(dat) for dat in rows]
+
 class DataFile(object):
     """A robust class for creating and writing to data files.
 
@@ -203,11 +471,17 @@ class DataFile(object):
             so they can be easily ignored when reading in the data.
         sep (str, optional): The delimiter character to use to separate columns
             in the output file. Defaults to a single tab.
+        schema (RowSchema, optional): A schema controlling how each column is
+            validated and formatted. Defaults to a plain schema built from
+            the header.
 
     """
-    def __init__(self, outpath, header, comments=[], sep="\t"):
+    def __init__(self, outpath, header, comments=[], sep="\t", schema=None):
         self.filepath = outpath
         self.header = header
+        self.schema = schema if schema else RowSchema(header)
+        if self.schema.columns != list(header):
+            raise ValueError("Schema columns must match the data file header.")
         self.comments = "\n".join(["# " + line for line in comments])
         self.sep = sep
 
@@ -233,25 +507,315 @@ class DataFile(object):
                 names in the header.
 
         """
-        # First, make sure all columns in row exist in the header
-        for col in dat.keys():
-            if col not in self.header:
-                e = "'{0}' exists in row data but not data file header."
-                raise RuntimeError(e.format(col))
-
-        # Then, sanitize the data to make sure it's all unicode text
-        out = {}
-        for col in self.header:
-            try:
-                out[col] = sdl2.ext.compat.utf8(dat[col])
-            except KeyError:
-                e = "No value for column '{0}' provided."
-                raise RuntimeError(e.format(col))
-        
-        # Finally, write the colletcted data to the file
+        self.write_rows([dat])
+
+    def write_rows(self, rows):
+        """Writes multiple rows of data to the output file at once.
+
+        Args:
+            rows (list): A list of dictionaries with fields matching each of
+                the column names in the header.
+
+        """
+        out = self.schema.encode_many(rows)
+
+        # Finally, write the collected data to the file
         with io.open(self.filepath, 'a', encoding='utf-8') as f:
-            writer = csv.DictWriter(f, fieldnames=self.header, delimiter=self.sep)
-            writer.writerow(out)
+            writer = csv.writer(f, delimiter=self.sep)
+            writer.writerows(out)
+
+    def end_block(self):
+        """Marks the end of a block of trials.
+
+        Does nothing for a basic DataFile, since every row is written to disk
+        as soon as it is added. Subclasses that buffer rows use this as a
+        flush point.
+
+        """
+        pass
+
+    def close(self):
+        """Closes the data file.
+
+        Does nothing for a basic DataFile, but should still be called at the
+        end of the session so that buffered subclasses can be swapped in.
+
+        """
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class BufferedDataFile(DataFile):
+    """A DataFile that keeps a single handle open for the whole session.
+
+    Rows are written to an open file handle instead of re-opening the file
+    for every trial, so adding a row between trials is just an in-memory
+    append. When the rows actually reach the disk is controlled by the flush
+    policy arguments below, allowing crash-safety to be traded off against
+    inter-trial disk activity.
+
+    The file must be closed with `close` (or by using the DataFile as a
+    context manager) at the end of the session, which flushes any remaining
+    rows.
+
+    Args:
+        outpath (str): The path at which to create the output file.
+        header (list): A list defining the names and order of columns for
+            the file.
+        comments (list, optional): A list of lines to append to the top of
+            the file above the header.
+        sep (str, optional): The delimiter character to use to separate columns
+            in the output file. Defaults to a single tab.
+        flush_rows (int, optional): Flush the file after this many rows have
+            been written since the last flush. Defaults to 1 (every row). Set
+            to None to disable row-count flushing.
+        flush_interval (float, optional): Flush the file when a row is written
+            and at least this many seconds have passed since the last flush.
+            Defaults to None (disabled).
+        flush_on_block (bool, optional): Whether to flush the file at the end
+            of each block. Defaults to True.
+        fsync (bool, optional): Whether to ask the OS to commit the file to
+            disk (``os.fsync``) on every flush. Defaults to False.
+        schema (RowSchema, optional): A schema controlling how each column is
+            validated and formatted. Defaults to a plain schema built from
+            the header.
+
+    """
+    def __init__(self, outpath, header, comments=[], sep="\t", flush_rows=1,
+            flush_interval=None, flush_on_block=True, fsync=False, schema=None):
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.flush_on_block = flush_on_block
+        self.fsync = fsync
+        self._file = None
+        super(BufferedDataFile, self).__init__(
+            outpath, header, comments, sep, schema
+        )
+
+    def _create(self):
+        super(BufferedDataFile, self)._create()
+        self._file = io.open(self.filepath, 'a', encoding='utf-8')
+        self._writer = csv.writer(self._file, delimiter=self.sep)
+        self._pending = 0
+        self._last_flush = time.perf_counter()
+
+    @property
+    def closed(self):
+        return self._file is None
+
+    def write_row(self, dat):
+        """Adds a row of data to the output file.
+
+        Args:
+            dat (dict): A dictionary with fields matching each of the column
+                names in the header.
+
+        """
+        self.write_rows([dat])
+
+    def write_rows(self, rows):
+        """Adds multiple rows of data to the output file at once.
+
+        Args:
+            rows (list): A list of dictionaries with fields matching each of
+                the column names in the header.
+
+        """
+        if self._file is None:
+            raise RuntimeError("Cannot write to a closed DataFile.")
+        self._write_encoded(self.schema.encode_many(rows))
+
+    def _write_encoded(self, out):
+        self._writer.writerows(out)
+        self._pending += len(out)
+
+        # Flush the file if required by the flush policy
+        if self.flush_rows and self._pending >= self.flush_rows:
+            self._flush_file()
+        elif self.flush_interval is not None:
+            if time.perf_counter() - self._last_flush >= self.flush_interval:
+                self._flush_file()
+
+    def _flush_file(self):
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self._pending = 0
+        self._last_flush = time.perf_counter()
+
+    def flush(self):
+        """Writes any buffered rows to the output file.
+
+        If `fsync` is enabled, the OS is also asked to commit the file to disk.
+
+        """
+        if self._file is not None:
+            self._flush_file()
+
+    def end_block(self):
+        if self.flush_on_block:
+            self.flush()
+
+    def close(self):
+        if self._file is None:
+            return
+        self._flush_file()
+        self._file.close()
+        self._file = None
+
+
+class AsyncDataFile(BufferedDataFile):
+    """A DataFile that writes rows to disk on a background thread.
+
+    Rows are validated on the calling thread (so bad rows still raise
+    immediately) and then handed to a dedicated writer thread through a
+    bounded queue, meaning a slow or stalled disk never delays the next
+    trial. Flushing follows the same policy arguments as `BufferedDataFile`,
+    but is performed by the writer thread.
+
+    If the queue is full, `write_row` blocks until the writer catches up.
+    Each time this happens it is counted as a stall, and the number of
+    stalls, the total time spent blocked, and the deepest queue seen are
+    available through `stats` so back-pressure can be reported at the end of
+    a session.
+
+    Queued rows are drained when the file is closed, when the experiment is
+    quit through `check_for_quit`, and at interpreter exit.
+
+    Args:
+        outpath (str): The path at which to create the output file.
+        header (list): A list defining the names and order of columns for
+            the file.
+        comments (list, optional): A list of lines to append to the top of
+            the file above the header.
+        sep (str, optional): The delimiter character to use to separate columns
+            in the output file. Defaults to a single tab.
+        max_queue (int, optional): The maximum number of rows that can be
+            waiting to be written before `write_row` blocks. Defaults to 1000.
+        **kwargs: Flush policy arguments passed on to `BufferedDataFile`.
+
+    """
+    _FLUSH = object()
+    _STOP = object()
+
+    def __init__(self, outpath, header, comments=[], sep="\t", max_queue=1000,
+            **kwargs):
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._error = None
+        self.stalls = 0
+        self.stall_time = 0.0
+        self.max_depth = 0
+        super(AsyncDataFile, self).__init__(
+            outpath, header, comments, sep, **kwargs
+        )
+        self._thread = threading.Thread(
+            target=self._writer_loop, name="DataFileWriter", daemon=True
+        )
+        self._thread.start()
+
+        # Make sure queued rows are written if the session ends early
+        add_quit_hook(self.close)
+        atexit.register(self.close)
+
+    @property
+    def pending(self):
+        """int: The number of rows waiting to be written."""
+        return self._queue.qsize()
+
+    @property
+    def stats(self):
+        """dict: Back-pressure statistics for the writer queue."""
+        return {
+            'pending': self.pending,
+            'max_depth': self.max_depth,
+            'stalls': self.stalls,
+            'stall_time': self.stall_time,
+        }
+
+    def _writer_loop(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is self._STOP:
+                    break
+                elif item is self._FLUSH:
+                    self._flush_file()
+                else:
+                    self._write_encoded(item)
+            except Exception as e:
+                # Keep draining the queue, but report the error to the caller
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _check_error(self):
+        if self._error is not None:
+            e, self._error = self._error, None
+            raise RuntimeError("Error writing to data file: {0}".format(e))
+
+    def _put(self, item):
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            # Writer has fallen behind, so block until there is room
+            self.stalls += 1
+            stall_start = time.perf_counter()
+            self._queue.put(item)
+            self.stall_time += time.perf_counter() - stall_start
+        self.max_depth = max(self.max_depth, self._queue.qsize())
+
+    def write_row(self, dat):
+        """Queues a row of data to be written to the output file.
+
+        Args:
+            dat (dict): A dictionary with fields matching each of the column
+                names in the header.
+
+        """
+        self.write_rows([dat])
+
+    def write_rows(self, rows):
+        """Queues multiple rows of data to be written to the output file.
+
+        Args:
+            rows (list): A list of dictionaries with fields matching each of
+                the column names in the header.
+
+        """
+        if self._file is None:
+            raise RuntimeError("Cannot write to a closed DataFile.")
+        self._check_error()
+        self._put(self.schema.encode_many(rows))
+
+    def flush(self):
+        """Waits for all queued rows to be written and flushes the file.
+
+        """
+        if self._file is None:
+            return
+        self._put(self._FLUSH)
+        self._queue.join()
+        self._check_error()
+
+    def end_block(self):
+        # Flush in the background so the end of a block never waits on disk
+        if self.flush_on_block and self._file is not None:
+            self._put(self._FLUSH)
+
+    def close(self):
+        if self._file is None:
+            return
+        # Drain the queue and stop the writer thread before closing the file
+        self._put(self._STOP)
+        self._thread.join()
+        BufferedDataFile.close(self)
+        remove_quit_hook(self.close)
+        self._check_error()
 
 #define a function that waits for a response
 def waitForResponse(timeout=None,terminate=False):
@@ -275,10 +839,13 @@ def waitForResponse(timeout=None,terminate=False):
     responses = []
     done = False
     while not done:
+        wait = None
         if timeout!=None:
-            if time.perf_counter()>timeout:
+            remaining = timeout - time.perf_counter()
+            if remaining <= 0:
                 done = True
-        events = pump()
+            wait = min(event_max_latency, max(0, remaining * 1000))
+        events = wait_events(wait)
         check_for_quit(events)
         for event in events:
             if event.type == sdl2.SDL_KEYDOWN:
@@ -288,6 +855,3 @@ def waitForResponse(timeout=None,terminate=False):
                 if terminate:
                     done = True
     return responses
-
-
-
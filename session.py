@@ -0,0 +1,235 @@
+"""Setup and teardown shared by the experiment scripts.
+
+Both versions of the experiment (with and without feedback) record their
+sessions the same way: a per-participant CSV (plus an optional columnar array
+and study database), a journal for resuming after a crash, a log of when each
+trigger was sent, an entry in the participant registry, and a snapshot of the
+code. `Session` creates and closes all of these, so the two scripts only
+differ in their trials and blocks.
+
+"""
+import os
+
+from communication import get_trigger_port, TriggerDispatcher
+from journal import Journal, read_journal, get_progress
+from triggerlog import TriggerLog
+from database import SQLiteDataFile
+from columnar import ColumnarDataFile
+from registry import Registry, COMPLETED, ABORTED
+from snapshot import snapshot_code
+from resources import AsyncDataFile, add_quit_hook, remove_quit_hook
+
+# Marker codes sent to the trigger port for EMG collection
+TRIGGER_CODES = {
+    'trial_start': 2,
+    'circle_on': 4,
+    'trial_end': 8,
+    'release': 16,
+}
+
+
+def init_trigger_port(simulate=False):
+    """Creates the trigger port for the goggles and EMG markers.
+
+    Args:
+        simulate (bool, optional): Whether to use a simulated LabJack U3
+            instead of any connected hardware. Defaults to False.
+
+    Returns:
+        TriggerDispatcher: The port, sending triggers from a background
+        thread, with the `TRIGGER_CODES` added.
+
+    """
+    port = TriggerDispatcher(get_trigger_port(simulate=simulate))
+    port.add_codes(TRIGGER_CODES)
+    return port
+
+
+class Session(object):
+    """Creates and closes the data files for a participant's session.
+
+    Once a session is started (or resumed), the participant's data files are
+    available as `data`, `journal` and `triggers`. Until `complete` is called,
+    quitting the experiment marks the session as aborted in the registry and
+    waits for any queued triggers to be logged.
+
+    Args:
+        data_dir (str): The path of the study's data folder.
+        header (list): The names and order of the columns for the data files.
+        port (TriggerDispatcher): The trigger port, whose writes are logged
+            for each session.
+        categorical (list, optional): The names of the columns to store as
+            categories in columnar data files. Defaults to
+            `columnar.CATEGORICAL_COLS`.
+        npy (bool, optional): Whether to also save trials as a columnar
+            ``.npy`` array. Defaults to False.
+        sqlite (bool, optional): Whether to also write trials to the shared
+            study database. Defaults to False.
+
+    """
+    def __init__(self, data_dir, header, port, categorical=None, npy=False,
+                 sqlite=False):
+        self.data_dir = data_dir
+        self.header = header
+        self.port = port
+        self.categorical = categorical
+        self.npy = npy
+        self.sqlite = sqlite
+        # Index of all participants run so far and the status of their sessions
+        self.registry = Registry(os.path.join(data_dir, "registry.json"))
+        self.participant_id = None
+        self.data = None
+        self.journal = None
+        self.triggers = None
+
+    def _journal_path(self, participant_id):
+        return os.path.join(
+            self.data_dir, participant_id, participant_id + "_journal.bin"
+        )
+
+    def _open(self, participant_id, group=None, resume=False):
+        # Creates the data folder and files for the participant
+        participant_dir = os.path.join(self.data_dir, participant_id)
+        if not os.path.exists(participant_dir):
+            os.mkdir(participant_dir)
+
+        # Store a snapshot of the experiment code (once per unique version) and
+        # record the version the session was run with. This is done here
+        # rather than at import time so that modules imported during setup
+        # (e.g. u3sim with -simulate-u3) are included. Use snapshot.restore to
+        # get the code for a version
+        code_version = snapshot_code(os.path.join(self.data_dir, ".code"))
+        code_path = os.path.join(participant_dir, participant_id + "_code_version.txt")
+        with open(code_path, 'w') as f:
+            f.write(code_version + "\n")
+
+        # Write rows on a background thread so disk stalls never delay the
+        # next trial
+        data_path = os.path.join(participant_dir, participant_id + "reach_and_point.csv")
+        self.data = AsyncDataFile(
+            data_path, self.header, comments=["code version: " + code_version],
+            sep=',', flush_rows=1
+        )
+        if self.npy:
+            npy_path = os.path.join(participant_dir, participant_id + "reach_and_point.npy")
+            self.data = ColumnarDataFile(
+                npy_path, self.header, mirror=self.data,
+                categorical=self.categorical
+            )
+        if self.sqlite:
+            db_path = os.path.join(self.data_dir, "study.sqlite")
+            self.data = SQLiteDataFile(
+                db_path, self.header, key={'id': participant_id}, mirror=self.data
+            )
+
+        # Create the session journal, used to resume the session after a crash
+        self.journal = Journal(self._journal_path(participant_id), resume=resume)
+
+        # Create the trigger log, recording when each trigger was actually sent
+        # (use triggerlog.join_triggers to add these times to the trial data)
+        triggers_path = os.path.join(participant_dir, participant_id + "_triggers.bin")
+        self.triggers = TriggerLog(triggers_path, codes=self.port.codes, resume=resume)
+        self.port.log = self.triggers
+        add_quit_hook(self.close_trigger_log)
+
+        self.participant_id = participant_id
+        self.registry.start(participant_id, group)
+        add_quit_hook(self.mark_aborted)
+
+    def start(self, info):
+        """Starts a new session for a participant.
+
+        Args:
+            info (dict): The participant's info, including their 'id' and
+                'group'.
+
+        """
+        self._open(info['id'], info['group'])
+        self.journal.append('session', info=info)
+
+    def read_progress(self, participant_id):
+        """Reads how far a participant's session got from their journal.
+
+        Args:
+            participant_id (str): The ID of the participant.
+
+        Returns:
+            tuple: The participant's info (or None if no session was found),
+            the data rows of all completed trials, a dict mapping each block
+            number to the number of trials completed in it, and whether the
+            session was completed.
+
+        """
+        records, _ = read_journal(self._journal_path(participant_id))
+        info, rows, progress = get_progress(records)
+        complete = any(record['type'] == 'complete' for record in records)
+        return info, rows, progress, complete
+
+    def resume(self, participant_id):
+        """Reopens an interrupted session from the participant's journal.
+
+        The data files are rewritten with all trials completed before the
+        interruption, so that they match the journal exactly.
+
+        Args:
+            participant_id (str): The ID of the participant.
+
+        Returns:
+            tuple: The participant's info, and a dict mapping each block number
+            to the number of trials completed in it.
+
+        """
+        info, rows, progress, _ = self.read_progress(participant_id)
+        if info is None:
+            e = "No session found to resume for participant '{0}'."
+            raise RuntimeError(e.format(participant_id))
+        self._open(participant_id, info['group'], resume=True)
+        for row in rows:
+            self.data.write_row(row)
+        return info, progress
+
+    def end_block(self):
+        """Saves the block's trials and the times of its trigger writes.
+
+        """
+        self.data.end_block()
+        self.port.flush()
+        self.triggers.flush()
+
+    def mark_aborted(self):
+        """Marks the session as aborted in the registry.
+
+        Called on quitting the experiment, until the session is completed.
+
+        """
+        self.registry.set_status(self.participant_id, ABORTED)
+
+    def close_trigger_log(self, timeout=1.0):
+        """Waits for any queued trigger writes to be logged, then closes the
+        trigger log.
+
+        Args:
+            timeout (float, optional): The longest time to wait for the queued
+                writes, in seconds, so that a stuck port can't stop a quit.
+                Defaults to 1.0. If None, waits indefinitely.
+
+        """
+        self.port.flush(timeout)
+        self.triggers.close()
+
+    def complete(self):
+        """Records that the session is complete and closes its data files.
+
+        """
+        self.journal.append('complete')
+        self.journal.close()
+        # Quitting from here on (e.g. on the final screen) shouldn't mark the
+        # completed session as aborted
+        remove_quit_hook(self.mark_aborted)
+        self.registry.set_status(self.participant_id, COMPLETED)
+        self.data.close()
+        self.close_trigger_log(timeout=None)
+        stalls = self.data.stats.get('stalls', 0)
+        if stalls:
+            stall_ms = self.data.stats['stall_time'] * 1000
+            print("\nNOTE: Data writer fell behind {0} times ({1:.1f} ms total)\n".format(stalls, stall_ms))
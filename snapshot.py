@@ -0,0 +1,143 @@
+"""Content-addressed storage for the code each session was run with.
+
+Instead of copying the experiment script into every participant's folder,
+each experiment module is stored once under the hash of its contents, along
+with a manifest listing the modules (and their hashes) that make up a given
+version of the experiment. Participants' folders then only need to record the
+hash of that manifest, and `restore` can rebuild the exact code from it.
+
+The store is laid out as::
+
+    <store>/objects/<file hash>           contents of each unique module
+    <store>/manifests/<version hash>.json  {module name: file hash}
+
+"""
+import os
+import io
+import sys
+import json
+import hashlib
+
+
+def _hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def _write_atomic(path, data):
+    tmp_path = path + ".tmp"
+    with io.open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def experiment_modules(root=None):
+    """Finds the source files of all loaded modules that are part of the
+    experiment.
+
+    Args:
+        root (str, optional): The folder containing the experiment code.
+            Defaults to the folder containing the main script.
+
+    Returns:
+        list: The paths of the source files of all loaded modules in the
+        folder, including the main script.
+
+    """
+    if root is None:
+        root = os.path.dirname(os.path.abspath(sys.argv[0]))
+    root = os.path.abspath(root)
+    paths = set()
+    for module in list(sys.modules.values()):
+        path = getattr(module, '__file__', None)
+        if not path or not path.endswith('.py'):
+            continue
+        path = os.path.abspath(path)
+        if os.path.dirname(path) == root:
+            paths.add(path)
+    return sorted(paths)
+
+
+def snapshot_code(store_dir, paths=None):
+    """Stores a snapshot of the experiment code and returns its version hash.
+
+    Each file is only written to the store if an identical file isn't already
+    there, so running the same code for many participants stores it once.
+
+    Args:
+        store_dir (str): The path of the snapshot store folder. Will be
+            created if it doesn't already exist.
+        paths (list, optional): The source files to include in the snapshot.
+            Defaults to all loaded experiment modules (see
+            `experiment_modules`).
+
+    Returns:
+        str: The hash identifying this version of the code.
+
+    """
+    if paths is None:
+        paths = experiment_modules()
+    objects_dir = os.path.join(store_dir, "objects")
+    manifests_dir = os.path.join(store_dir, "manifests")
+    for d in (objects_dir, manifests_dir):
+        if not os.path.exists(d):
+            os.makedirs(d)
+
+    # Store each unique file under the hash of its contents
+    manifest = {}
+    for path in paths:
+        with io.open(path, 'rb') as f:
+            data = f.read()
+        file_hash = _hash(data)
+        manifest[os.path.basename(path)] = file_hash
+        object_path = os.path.join(objects_dir, file_hash)
+        if not os.path.exists(object_path):
+            _write_atomic(object_path, data)
+
+    # Store the manifest under the hash of its contents
+    content = json.dumps(manifest, sort_keys=True, indent=1).encode('utf-8')
+    version = _hash(content)
+    manifest_path = os.path.join(manifests_dir, version + ".json")
+    if not os.path.exists(manifest_path):
+        _write_atomic(manifest_path, content)
+
+    return version
+
+
+def get_manifest(store_dir, version):
+    """Gets the list of files making up a stored version of the code.
+
+    Args:
+        store_dir (str): The path of the snapshot store folder.
+        version (str): The version hash from `snapshot_code`.
+
+    Returns:
+        dict: A mapping of file names to the hashes of their contents.
+
+    """
+    manifest_path = os.path.join(store_dir, "manifests", version + ".json")
+    with io.open(manifest_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def restore(store_dir, version, out_dir):
+    """Recreates the files of a stored version of the code.
+
+    Args:
+        store_dir (str): The path of the snapshot store folder.
+        version (str): The version hash from `snapshot_code`.
+        out_dir (str): The folder to write the files to. Will be created if it
+            doesn't already exist.
+
+    """
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    for name, file_hash in get_manifest(store_dir, version).items():
+        with io.open(os.path.join(store_dir, "objects", file_hash), 'rb') as f:
+            data = f.read()
+        with io.open(os.path.join(out_dir, name), 'wb') as f:
+            f.write(data)
+
+
+if __name__ == "__main__":
+    # e.g. python snapshot.py _Data/.code <version> restored_code/
+    restore(*sys.argv[1:4])
@@ -0,0 +1,44 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from columnar import ColumnarDataFile, load_session, decode
+
+
+HEADER = ['id', 'block', 'trial_num', 'distance_x', 'goggles_removed']
+
+
+def test_bad_row_leaves_columns_aligned(tmp_path):
+    path = str(tmp_path / "P01.npy")
+    out = ColumnarDataFile(path, HEADER)
+    out.write_row({'id': 'P01', 'block': 'Baseline', 'trial_num': 1,
+        'distance_x': 1.5, 'goggles_removed': 'N'})
+    with pytest.raises(ValueError):
+        out.write_row({'id': 'P01', 'block': 'PostTest', 'trial_num': 'x',
+            'distance_x': 2.5, 'goggles_removed': 'Y'})
+    out.write_row({'id': 'P01', 'block': 'PostTest', 'trial_num': 2,
+        'distance_x': 0.5, 'goggles_removed': 'Y'})
+    out.close()
+
+    arr, categories = load_session(path, mmap=False)
+    assert list(arr['trial_num']) == [1, 2]
+    assert list(arr['distance_x']) == [1.5, 0.5]
+    assert list(decode(arr, categories, 'block')) == ['Baseline', 'PostTest']
+    # Columns not passed as categorical are stored as numbers
+    assert 'goggles_removed' not in categories
+
+
+def test_categorical_columns_passed_in(tmp_path):
+    path = str(tmp_path / "N01.npy")
+    categorical = ['id', 'block', 'goggles_removed']
+    out = ColumnarDataFile(path, HEADER, categorical=categorical)
+    out.write_row({'id': 'N01', 'block': 'MIExposure', 'trial_num': 1,
+        'distance_x': 1.5, 'goggles_removed': 'Y'})
+    out.close()
+
+    arr, categories = load_session(path, mmap=False)
+    assert sorted(categories) == sorted(categorical)
+    assert list(decode(arr, categories, 'goggles_removed')) == ['Y']
@@ -0,0 +1,31 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import SQLiteDataFile, query_trials
+
+
+def write(path, header, row):
+    db = SQLiteDataFile(path, header, key={'id': row['id']})
+    db.write_row(row)
+    db.close()
+
+
+def test_tables_gain_new_header_columns(tmp_path):
+    path = str(tmp_path / "study.sqlite")
+    write(path, ['id', 'block', 'distance_x'],
+        {'id': 'P01', 'block': 'Baseline', 'distance_x': 1.5})
+    # e.g. the NF script, with extra columns in the middle of its header
+    write(path, ['id', 'block', 'MIRating', 'goggles_removed', 'distance_x'],
+        {'id': 'N01', 'block': 'MIExposure', 'MIRating': 3,
+         'goggles_removed': 'N', 'distance_x': 2.5})
+    write(path, ['id', 'block', 'distance_x'],
+        {'id': 'P02', 'block': 'PostTest', 'distance_x': 0.5})
+
+    rows = query_trials(path, ['id', 'MIRating', 'distance_x'])
+    assert rows == [
+        {'id': 'P01', 'MIRating': None, 'distance_x': 1.5},
+        {'id': 'N01', 'MIRating': 3, 'distance_x': 2.5},
+        {'id': 'P02', 'MIRating': None, 'distance_x': 0.5},
+    ]
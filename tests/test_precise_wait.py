@@ -0,0 +1,52 @@
+import os
+import sys
+
+import pytest
+import sdl2
+import sdl2.ext
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from resources import pump
+from timing import precise_wait
+
+
+@pytest.fixture(autouse=True)
+def sdl(monkeypatch):
+    monkeypatch.setenv('SDL_VIDEODRIVER', 'dummy')
+    sdl2.ext.init()
+    pump()
+    yield
+    sdl2.ext.quit()
+
+
+def push_key(sym):
+    event = sdl2.SDL_Event()
+    event.type = sdl2.SDL_KEYDOWN
+    event.key.keysym.sym = sym
+    sdl2.SDL_PushEvent(event)
+
+
+def is_escape(events):
+    return any(e.key.keysym.sym == sdl2.SDLK_ESCAPE for e in events)
+
+
+def test_peeking_leaves_events_queued():
+    push_key(sdl2.SDLK_RETURN)
+    handled = []
+    waited, early = precise_wait(0.05, on_events=handled.extend, consume=False)
+    assert not early and waited >= 0.05
+    assert len(handled) == 1 # each event is only passed on once
+    assert [e.key.keysym.sym for e in pump()] == [sdl2.SDLK_RETURN]
+
+
+def test_peeking_still_ends_early():
+    push_key(sdl2.SDLK_ESCAPE)
+    waited, early = precise_wait(0.5, on_events=is_escape, consume=False)
+    assert early and waited < 0.5
+
+
+def test_consuming_removes_events():
+    push_key(sdl2.SDLK_RETURN)
+    precise_wait(0.05, on_events=lambda events: False)
+    assert pump() == []
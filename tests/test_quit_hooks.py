@@ -0,0 +1,53 @@
+import os
+import sys
+
+import pytest
+import sdl2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import resources
+from registry import Registry, STARTED, COMPLETED, ABORTED
+from session import Session, init_trigger_port
+
+
+def quit_event():
+    event = sdl2.SDL_Event()
+    event.type = sdl2.SDL_QUIT
+    return event
+
+
+@pytest.fixture
+def session(tmp_path, monkeypatch):
+    monkeypatch.setattr(resources, '_quit_hooks', [])
+    monkeypatch.setattr(sdl2.ext, 'quit', lambda: None)
+    port = init_trigger_port(simulate=True)
+    session = Session(str(tmp_path), ['id', 'trial_num'], port)
+    session.start({'id': 'P01', 'group': 'PP'})
+    yield session
+    port.close()
+
+
+def status(session):
+    return Registry(session.registry.path).get('P01')['status']
+
+
+def test_quit_during_session_marks_aborted(session):
+    with pytest.raises(SystemExit):
+        resources.check_for_quit([quit_event()])
+    assert status(session) == ABORTED
+
+
+def test_quit_after_completion_keeps_completed(session):
+    session.complete()
+    assert session.mark_aborted not in resources._quit_hooks
+
+    # e.g. quitting on the final 'done' screen
+    with pytest.raises(SystemExit):
+        resources.check_for_quit([quit_event()])
+    assert status(session) == COMPLETED
+
+
+def test_no_quit_event_runs_no_hooks(session):
+    resources.check_for_quit([])
+    assert status(session) == STARTED
@@ -0,0 +1,69 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import resources
+from columnar import read_csv
+from registry import Registry, STARTED, COMPLETED
+from session import Session, init_trigger_port
+from triggerlog import read_trigger_log
+
+HEADER = ['id', 'group', 'block', 'block_num', 'trial_num', 'distance_x']
+
+
+@pytest.fixture
+def session(tmp_path, monkeypatch):
+    monkeypatch.setattr(resources, '_quit_hooks', [])
+    port = init_trigger_port(simulate=True)
+    yield Session(str(tmp_path), HEADER, port)
+    port.close()
+
+
+def trial(num):
+    return {'id': 'P01', 'group': 'PP', 'block': 'Baseline', 'block_num': 2,
+        'trial_num': num, 'distance_x': num * 0.5}
+
+
+def test_complete_session(session, tmp_path):
+    session.start({'id': 'P01', 'group': 'PP'})
+    session.port.log.set_trial(2, 1)
+    session.port.send('trial_start')
+    session.data.write_row(trial(1))
+    session.journal.append('trial', block_num=2, data=trial(1))
+    session.end_block()
+    session.complete()
+
+    assert Registry(session.registry.path).get('P01')['status'] == COMPLETED
+    assert resources._quit_hooks == [session.close_trigger_log]
+    header, rows = read_csv(str(tmp_path / "P01" / "P01reach_and_point.csv"))
+    assert header == HEADER and len(rows) == 1
+    # The trigger sent during the block is logged before the log is closed
+    _, events = read_trigger_log(str(tmp_path / "P01" / "P01_triggers.bin"))
+    assert [(e['value'], e['block_num'], e['trial_num']) for e in events][0] == (2, 2, 1)
+    assert session.read_progress('P01')[3]
+
+
+def test_resume_session(session, tmp_path):
+    session.start({'id': 'P01', 'group': 'PP'})
+    for num in (1, 2):
+        session.data.write_row(trial(num))
+        session.journal.append('trial', block_num=2, data=trial(num))
+    session.data.close()
+    session.journal.close()
+
+    info, progress = session.resume('P01')
+    assert info == {'id': 'P01', 'group': 'PP'}
+    assert progress == {2: 2}
+    session.data.close()
+    # The data file is rebuilt from the journal, without duplicate rows
+    _, rows = read_csv(str(tmp_path / "P01" / "P01reach_and_point.csv"))
+    assert [row[4] for row in rows] == ['1', '2']
+    assert Registry(session.registry.path).get('P01')['status'] == STARTED
+
+
+def test_resume_missing_session(session):
+    with pytest.raises(RuntimeError):
+        session.resume('P02')
@@ -0,0 +1,106 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import u3sim
+from communication import U3Port, TriggerDispatcher, get_trigger_port
+
+
+@pytest.fixture
+def device():
+    return u3sim.U3(latency=0, jitter=0, seed=1)
+
+
+def widths(history, port):
+    # Gets the width (in device time, ms) of each pulse on a port
+    index = u3sim._PORTS.index(port) + 1
+    out = []
+    onset = None
+    for change in history:
+        if change[index] and onset is None:
+            onset = change[0]
+        elif not change[index] and onset is not None:
+            out.append((change[0] - onset) * 1000)
+            onset = None
+    return out
+
+
+def test_simulated_port_selected():
+    port = get_trigger_port(simulate=True)
+    assert isinstance(port, U3Port)
+    assert isinstance(port._device, u3sim.U3)
+    assert port._feedback is not None
+
+
+def test_register_writes(device):
+    port = U3Port(device, u3=u3sim)
+    port._feedback = None
+    port.write(5)
+    port.write(0x1FF, port='FIO') # only the low byte is written
+    port.write(0xFF, port='CIO') # CIO only has 4 pins
+    assert device.state == {'FIO': 0xFF, 'EIO': 5, 'CIO': 0x0F}
+
+    port.write_ports({'FIO': 3, 'EIO': 8})
+    assert device.state['FIO'] == 3 and device.state['EIO'] == 8
+
+
+def test_feedback_pulse_timed_on_device(device):
+    port = U3Port(device, u3=u3sim)
+    calls = device.calls
+    port.pulse(4, duration=40) # one WaitLong and several WaitShorts
+    assert device.calls == calls + 1 # a single transaction
+    assert widths(device.history, 'EIO') == [pytest.approx(40, abs=0.13)]
+    assert device.state['EIO'] == 0
+
+
+def test_feedback_pulse_holds_other_ports(device):
+    port = U3Port(device, u3=u3sim)
+    port.pulse(16, duration=4, hold={'FIO': 3})
+    # The held port changes in the same command as the pulse and stays set
+    onset = [change for change in device.history if change[2] == 16][0]
+    assert onset[1] == 3
+    assert device.state == {'FIO': 3, 'EIO': 0, 'CIO': 0}
+    assert port.state == device.state
+
+
+def test_old_hardware_wait_units():
+    device = u3sim.U3(latency=0, jitter=0, hardwareVersion=1.21)
+    port = U3Port(device, u3=u3sim)
+    port.pulse(4, duration=4)
+    assert widths(device.history, 'EIO') == [pytest.approx(4, abs=0.07)]
+
+
+def test_failed_feedback_falls_back_to_registers(device):
+    port = U3Port(device, u3=u3sim)
+
+    def fail(*commands):
+        raise u3sim.LabJackException("feedback failed")
+    device.getFeedback = fail
+
+    port.pulse(8, duration=4)
+    assert port._feedback is None
+    assert [change[2] for change in device.history[-2:]] == [8, 0]
+    assert device.state['EIO'] == 0
+
+
+def test_dispatcher_records_failed_writes(device):
+    port = U3Port(device, u3=u3sim)
+    dispatcher = TriggerDispatcher(port)
+    dispatcher.add_code('trial_start', 2)
+
+    device.disconnect()
+    dispatcher.send('trial_start')
+    dispatcher.write(1)
+    assert dispatcher.flush(timeout=1)
+    assert [error[:2] for error in dispatcher.errors] == [('trial_start', 2), (None, 1)]
+
+    # Later writes are still sent once the device is back
+    device.reconnect()
+    dispatcher.write(7)
+    assert dispatcher.flush(timeout=1)
+    assert device.state['EIO'] == 7
+    assert len(dispatcher.writes) == 1
+    dispatcher.close()
@@ -0,0 +1,754 @@
+import re
+import ctypes
+import struct
+from collections import OrderedDict
+
+import sdl2
+import sdl2.ext
+from sdl2 import sdlttf
+from aggdraw import Brush, Pen
+
+from resources import draw_circle
+
+# Characters included in a glyph atlas by default (printable ASCII and Latin-1)
+ATLAS_CHARS = u"".join(chr(c) for c in list(range(32, 127)) + list(range(161, 256)))
+
+# The memory layout of an SDL_Vertex: position, RGBA color, texture coordinates
+_VERTEX = struct.Struct("=ff4Bff")
+
+# Splits a line of text into words, each with its surrounding whitespace
+_WORD_RE = re.compile(r"\s*\S+\s*")
+
+
+class TextureCache(object):
+    """A least-recently-used cache of rendered text textures.
+
+    Rendering a screen of text (rasterizing each glyph and uploading the
+    result to the GPU as a texture) takes long enough to delay the appearance
+    of a message, so this cache keeps the textures for recently shown text
+    around and reuses them when the same text is shown again. Textures are
+    keyed by their text and how it was rendered (font style, wrap width, and
+    alignment).
+
+    When the cache holds more than `max_items` textures or more than
+    `max_bytes` of texture data, the least recently used textures are
+    destroyed until it fits again.
+
+    Args:
+        renderer (sdl2.ext.Renderer): The renderer the textures are drawn with.
+        font (sdl2.ext.FontTTF): The font to render text with.
+        max_items (int, optional): The largest number of textures to keep.
+            Defaults to 64.
+        max_bytes (int, optional): The largest total size of the kept
+            textures, in bytes (assuming 4 bytes per pixel). Defaults to 64 MB.
+
+    """
+    def __init__(self, renderer, font, max_items=64, max_bytes=64 * 1024 * 1024):
+        self.renderer = renderer
+        self.font = font
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self._textures = OrderedDict() # key: (texture, size in bytes)
+        self.nbytes = 0
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def __len__(self):
+        return len(self._textures)
+
+    def __contains__(self, key):
+        return key in self._textures
+
+    def _key(self, text, style, width, align):
+        if isinstance(text, list):
+            text = "\n".join(text)
+        return (text, style, width, align)
+
+    def _render(self, key):
+        text, style, width, align = key
+        surface = self.font.render_text(text, style, width=width, align=align)
+        try:
+            tx = sdl2.ext.Texture(self.renderer, surface)
+        finally:
+            sdl2.SDL_FreeSurface(surface)
+        w, h = tx.size
+        return tx, w * h * 4
+
+    def get(self, text, style='default', width=None, align='left'):
+        """Gets the texture for a piece of text, rendering it if necessary.
+
+        Args:
+            text (str or list): The text to render. Lists of lines are joined
+                with newlines.
+            style (str, optional): The font style to render the text with.
+                Defaults to 'default'.
+            width (int, optional): The width (in pixels) to wrap the text at.
+                Defaults to None (no wrapping).
+            align (str, optional): The alignment of the lines of text ('left',
+                'right', or 'center'). Defaults to 'left'.
+
+        Returns:
+            sdl2.ext.Texture: The rendered text. Don't destroy it, since it's
+            owned by the cache.
+
+        """
+        key = self._key(text, style, width, align)
+        if key in self._textures:
+            self._textures.move_to_end(key)
+            self.stats['hits'] += 1
+            return self._textures[key][0]
+
+        self.stats['misses'] += 1
+        tx, nbytes = self._render(key)
+        self._textures[key] = (tx, nbytes)
+        self.nbytes += nbytes
+        self._evict()
+        return tx
+
+    def prerender(self, texts, style='default', width=None, align='left'):
+        """Renders a set of texts ahead of time so they can be shown instantly.
+
+        Args:
+            texts (list): The texts to render (e.g. the values of the
+                instructions dict).
+            style, width, align: How to render the texts (see `get`).
+
+        """
+        for text in texts:
+            self.get(text, style, width, align)
+
+    def _evict(self):
+        # Destroys the least recently used textures until the cache fits its
+        # limits (always keeping the newest one)
+        while len(self._textures) > 1 and (
+            len(self._textures) > self.max_items or self.nbytes > self.max_bytes
+        ):
+            _, (tx, nbytes) = self._textures.popitem(last=False)
+            tx.destroy()
+            self.nbytes -= nbytes
+            self.stats['evictions'] += 1
+
+    def clear(self):
+        """Destroys all cached textures.
+
+        """
+        for tx, _ in self._textures.values():
+            tx.destroy()
+        self._textures.clear()
+        self.nbytes = 0
+
+
+class GlyphCache(object):
+    """Textures for individual characters, for drawing text that changes often.
+
+    Each character is rendered the first time it's drawn and reused after
+    that, so drawing a string only requires copying the textures of its
+    characters to the renderer instead of rendering the whole string again.
+
+    Args:
+        renderer (sdl2.ext.Renderer): The renderer the glyphs are drawn with.
+        font (sdl2.ext.FontTTF): The font to render glyphs with.
+        style (str, optional): The font style to render glyphs with. Defaults
+            to 'default'.
+
+    """
+    def __init__(self, renderer, font, style='default'):
+        self.renderer = renderer
+        self.font = font
+        self.style = style
+        self._glyphs = {}
+        # All glyphs are rendered at the full line height of the font
+        self.line_height = self.get(u' ').size[1]
+
+    def get(self, char):
+        """Gets the texture for a single character, rendering it if necessary.
+
+        Args:
+            char (str): The character.
+
+        Returns:
+            sdl2.ext.Texture: The rendered character.
+
+        """
+        tx = self._glyphs.get(char)
+        if tx is None:
+            surface = self.font.render_text(char, self.style)
+            try:
+                tx = sdl2.ext.Texture(self.renderer, surface)
+            finally:
+                sdl2.SDL_FreeSurface(surface)
+            self._glyphs[char] = tx
+        return tx
+
+    def width(self, text):
+        """Gets the width of a line of text in pixels.
+
+        """
+        return sum(self.get(c).size[0] for c in text)
+
+    def draw_line(self, text, x, y):
+        """Draws a single line of text with its top-left corner at (x, y).
+
+        Returns:
+            int: The x coordinate of the end of the drawn text.
+
+        """
+        for c in text:
+            tx = self.get(c)
+            w, h = tx.size
+            self.renderer.copy(tx, dstrect=(x, y, w, h))
+            x += w
+        return x
+
+    def destroy(self):
+        for tx in self._glyphs.values():
+            tx.destroy()
+        self._glyphs.clear()
+
+
+class TextEntry(object):
+    """A prompt and a line of text that's typed in one character at a time.
+
+    The prompt is rendered once, and the typed line is drawn from a
+    `GlyphCache` (or `GlyphAtlas`) into its own texture. When a character is added or removed,
+    only that character's part of the line texture is redrawn, so each
+    keystroke costs a couple of texture copies instead of rendering all of
+    the text again. If the renderer doesn't support drawing to textures, the
+    line is drawn glyph by glyph each time instead.
+
+    The prompt and the typed line are drawn as a single block of text
+    centered on `loc`, with the typed line centered below the prompt.
+    Characters that would make the typed line wider than `width` are
+    ignored.
+
+    Args:
+        renderer (sdl2.ext.Renderer): The renderer to draw with.
+        font (sdl2.ext.FontTTF): The font to render the text with.
+        prompt (str): The prompt to show above the typed text.
+        loc (tuple): The (x, y) coordinates of the center of the text.
+        width (int, optional): The width to wrap the prompt at, and the
+            widest the typed line can be, in pixels. Defaults to 780.
+        bg (tuple, optional): The background color. Defaults to black.
+        text_cache (TextureCache, optional): A cache to get the prompt's
+            texture from. Defaults to None (render the prompt directly).
+        glyphs (GlyphCache or GlyphAtlas, optional): The glyphs to draw typed
+            text with. Defaults to a new `GlyphCache` for `font`.
+
+    """
+    def __init__(self, renderer, font, prompt, loc, width=780, bg=(0, 0, 0),
+                 text_cache=None, glyphs=None):
+        self.renderer = renderer
+        self.loc = loc
+        self.width = width
+        self.bg = bg
+        self.text = u''
+        self._ends = [] # x coordinate of the end of each typed character
+
+        if text_cache is None:
+            text_cache = TextureCache(renderer, font)
+        self.prompt_tx = text_cache.get(prompt, width=width, align='center')
+        self.glyphs = glyphs or GlyphCache(renderer, font)
+        self.line_height = self.glyphs.line_height
+
+        # Create a texture to hold the typed line, if supported
+        self._line_tx = None
+        if sdl2.SDL_RenderTargetSupported(renderer.sdlrenderer):
+            self._line_tx = sdl2.SDL_CreateTexture(
+                renderer.sdlrenderer, sdl2.SDL_PIXELFORMAT_ARGB8888,
+                sdl2.SDL_TEXTUREACCESS_TARGET, width, self.line_height
+            )
+            if self._line_tx:
+                self._update_line(lambda: self.renderer.clear(self.bg))
+            else:
+                self._line_tx = None
+
+    @property
+    def _cursor(self):
+        return self._ends[-1] if self._ends else 0
+
+    def _update_line(self, draw):
+        # Draws to the typed line's texture instead of the screen
+        sdl2.SDL_SetRenderTarget(self.renderer.sdlrenderer, self._line_tx)
+        try:
+            draw()
+        finally:
+            sdl2.SDL_SetRenderTarget(self.renderer.sdlrenderer, None)
+
+    def insert(self, text):
+        """Adds typed text to the end of the line.
+
+        Returns:
+            bool: True if any characters were added, otherwise False.
+
+        """
+        added = False
+        for c in text:
+            x = self._cursor
+            end = x + self.glyphs.width(c)
+            if end > self.width:
+                break
+            if self._line_tx:
+                self._update_line(lambda: self.glyphs.draw_line(c, x, 0))
+            self.text += c
+            self._ends.append(end)
+            added = True
+        return added
+
+    def backspace(self):
+        """Removes the last character from the line.
+
+        Returns:
+            bool: True if a character was removed, otherwise False.
+
+        """
+        if not self.text:
+            return False
+        self._ends.pop()
+        self.text = self.text[:-1]
+        if self._line_tx:
+            x = self._cursor
+            rect = (x, 0, self.width - x, self.line_height)
+            self._update_line(lambda: self.renderer.fill(rect, self.bg))
+        return True
+
+    def draw(self):
+        """Draws the prompt and the typed line to the renderer.
+
+        """
+        cx, cy = self.loc
+        pw, ph = self.prompt_tx.size
+        top = int(cy - (ph + self.line_height) / 2)
+        self.renderer.clear(self.bg)
+        self.renderer.copy(self.prompt_tx, dstrect=(int(cx - pw / 2), top, pw, ph))
+
+        line_w = self._cursor
+        x = int(cx - line_w / 2)
+        y = top + ph
+        if not line_w:
+            return
+        if self._line_tx:
+            self.renderer.copy(
+                self._line_tx.contents, srcrect=(0, 0, line_w, self.line_height),
+                dstrect=(x, y, line_w, self.line_height)
+            )
+        else:
+            self.glyphs.draw_line(self.text, x, y)
+
+    def destroy(self):
+        """Frees the typed line's texture.
+
+        """
+        if self._line_tx:
+            sdl2.SDL_DestroyTexture(self._line_tx)
+            self._line_tx = None
+
+
+class GlyphAtlas(object):
+    """Draws text from a single texture containing all of a font's glyphs.
+
+    Every glyph is rendered once, when the atlas is created, and packed into
+    one texture. Text is then laid out by adding up the widths of its glyphs
+    (wrapping lines at word boundaries, like ``FontTTF.render_text``), and
+    drawn by copying each glyph's region of the atlas to the renderer. The
+    layout of each text block is cached, and with SDL 2.0.18 or newer all of
+    its glyphs are drawn in a single ``SDL_RenderGeometry`` call, so drawing
+    text takes about the same time regardless of whether (or how recently)
+    it has been drawn before.
+
+    Characters that aren't in the atlas are added (by rebuilding the atlas)
+    the first time they're drawn.
+
+    Args:
+        renderer (sdl2.ext.Renderer): The renderer to draw text with.
+        font (sdl2.ext.FontTTF): The font to render glyphs with.
+        style (str, optional): The font style to render glyphs with. Defaults
+            to 'default'.
+        chars (str, optional): The characters to include in the atlas.
+            Defaults to printable ASCII and Latin-1 characters.
+        max_layouts (int, optional): The number of most recently drawn text
+            layouts to cache. Defaults to 64.
+
+    """
+    def __init__(self, renderer, font, style='default', chars=ATLAS_CHARS,
+                 max_layouts=64):
+        self.renderer = renderer
+        self.font = font
+        self.style = style
+        self.max_layouts = max_layouts
+        self._ttf = font.get_ttf_font(style)
+        self.line_height = sdlttf.TTF_FontHeight(self._ttf)
+        self.line_skip = sdlttf.TTF_FontLineSkip(self._ttf)
+        self._geometry = sdl2.dll.version >= 2018
+        self._layouts = OrderedDict()
+        self.texture = None
+        self._glyphs = {} # char: (x, y, w) in the atlas
+        self._build(set(chars))
+
+    def _build(self, chars):
+        # Renders each glyph and packs them into rows of the atlas texture
+        info = sdl2.SDL_RendererInfo()
+        sdl2.SDL_GetRendererInfo(self.renderer.sdlrenderer, ctypes.byref(info))
+        atlas_w = min(info.max_texture_width or 2048, 2048)
+        h = self.line_height
+
+        surfaces = []
+        glyphs = {}
+        x, y = 0, 0
+        minx, maxx, miny, maxy, advance = [ctypes.c_int(0) for i in range(5)]
+        for c in sorted(chars):
+            sdlttf.TTF_GlyphMetrics32(
+                self._ttf, ord(c), ctypes.byref(minx), ctypes.byref(maxx),
+                ctypes.byref(miny), ctypes.byref(maxy), ctypes.byref(advance)
+            )
+            # Glyphs that extend left of the pen position are rendered shifted
+            # right by the overhang
+            offset = max(0, -minx.value)
+            try:
+                sf = self.font.render_text(c, self.style)
+            except sdl2.ext.SDLError:
+                # Characters with no width (e.g. soft hyphens) aren't drawn
+                glyphs[c] = (0, 0, 0, 0, advance.value)
+                continue
+            w = sf.w
+            if x + w > atlas_w:
+                x, y = 0, y + h
+            surfaces.append((c, sf, x, y, w, offset, advance.value))
+            x += w
+
+        atlas = sdl2.SDL_CreateRGBSurfaceWithFormat(
+            0, atlas_w, y + h, 32, sdl2.SDL_PIXELFORMAT_ARGB8888
+        )
+        for c, sf, x, y, w, offset, advance in surfaces:
+            # Copy the glyph's pixels as-is, including its transparency
+            sdl2.SDL_SetSurfaceBlendMode(sf, sdl2.SDL_BLENDMODE_NONE)
+            sdl2.SDL_BlitSurface(sf, None, atlas, sdl2.SDL_Rect(x, y, w, h))
+            sdl2.SDL_FreeSurface(sf)
+            glyphs[c] = (x, y, w, offset, advance)
+        try:
+            texture = sdl2.ext.Texture(self.renderer, atlas.contents)
+        finally:
+            sdl2.SDL_FreeSurface(atlas)
+        sdl2.SDL_SetTextureBlendMode(texture.tx, sdl2.SDL_BLENDMODE_BLEND)
+
+        if self.texture:
+            self.texture.destroy()
+        self.texture = texture
+        self._glyphs = glyphs
+        self._layouts.clear()
+
+    def _ensure(self, text):
+        # Adds any characters missing from the atlas
+        missing = set(text) - set(self._glyphs) - set(u"\n")
+        if missing:
+            self._build(set(self._glyphs) | missing)
+
+    def width(self, text):
+        """Gets the width of a line of text in pixels.
+
+        """
+        if not text:
+            return 0
+        self._ensure(text)
+        w, h = ctypes.c_int(0), ctypes.c_int(0)
+        sdlttf.TTF_SizeUTF8(self._ttf, text.encode('utf-8'), ctypes.byref(w), ctypes.byref(h))
+        return w.value
+
+    def _line_quads(self, line, x, y):
+        # Works out where each glyph of a line goes, following the font's
+        # advance widths (like SDL_ttf, without kerning)
+        quads = [] # (src x, src y, w, dst x, dst y)
+        pen = None
+        for c in line:
+            gx, gy, w, offset, advance = self._glyphs[c]
+            if pen is None:
+                pen = offset
+            if w and not c.isspace():
+                quads.append((gx, gy, w, x + pen - offset, y))
+            pen += advance
+        return quads
+
+    def _wrap(self, line, width):
+        # Splits a line into lines that fit within the width, breaking at
+        # whitespace (or within words too long to fit on a line of their own)
+        lines = []
+        current = u""
+        for word in _WORD_RE.findall(line):
+            candidate = current + word
+            if self.width(candidate.rstrip()) <= width:
+                current = candidate
+                continue
+            if current:
+                lines.append(current.rstrip())
+            current = word.lstrip()
+            while self.width(current.rstrip()) > width:
+                n = 1
+                while self.width(current[:n + 1]) <= width:
+                    n += 1
+                lines.append(current[:n])
+                current = current[n:]
+        lines.append(current.rstrip())
+        return lines
+
+    def _layout(self, text, loc, width, align, anchor):
+        # Works out where each glyph of a block of text goes on the screen
+        lines = []
+        for line in text.split(u"\n"):
+            if width is not None and self.width(line) > width:
+                lines += self._wrap(line, width)
+            else:
+                lines.append(line)
+
+        block_w = width if width is not None else max(self.width(l) for l in lines)
+        block_h = self.line_skip * (len(lines) - 1) + self.line_height
+        left = int(loc[0] - anchor[0] * block_w)
+        top = int(loc[1] - anchor[1] * block_h)
+
+        quads = [] # (src x, src y, w, dst x, dst y)
+        for i, line in enumerate(lines):
+            line_w = self.width(line)
+            if align == 'center':
+                x = left + int((block_w - line_w) / 2)
+            elif align == 'right':
+                x = left + block_w - line_w
+            else:
+                x = left
+            quads += self._line_quads(line, x, top + i * self.line_skip)
+        return quads
+
+    def _batch(self, quads):
+        # Builds the vertex and index arrays for drawing all the glyphs of a
+        # block at once, or the rects for copying them one at a time
+        h = self.line_height
+        if not self._geometry:
+            return [
+                (sdl2.SDL_Rect(gx, gy, w, h), sdl2.SDL_Rect(x, y, w, h))
+                for gx, gy, w, x, y in quads
+            ]
+        tw, th = [float(n) for n in self.texture.size]
+        data = []
+        for gx, gy, w, x, y in quads:
+            for dx, dy in ((0, 0), (w, 0), (w, h), (0, h)):
+                data.append(_VERTEX.pack(
+                    x + dx, y + dy, 255, 255, 255, 255,
+                    (gx + dx) / tw, (gy + dy) / th
+                ))
+        n = len(quads)
+        vertices = (sdl2.SDL_Vertex * (n * 4)).from_buffer_copy(b"".join(data))
+        indices = (ctypes.c_int * (n * 6))(*[
+            i * 4 + k for i in range(n) for k in (0, 1, 2, 0, 2, 3)
+        ])
+        return vertices, indices
+
+    def draw(self, text, loc, width=None, align='left', anchor=(0.5, 0.5)):
+        """Draws a block of text to the renderer.
+
+        Args:
+            text (str or list): The text to draw. Lists of lines are joined
+                with newlines.
+            loc (tuple): The (x, y) coordinates to draw the text at.
+            width (int, optional): The width (in pixels) to wrap the text at.
+                Defaults to None (no wrapping).
+            align (str, optional): The alignment of the lines of text ('left',
+                'right', or 'center'). Defaults to 'left'.
+            anchor (tuple, optional): The point of the text block to place at
+                `loc`, as fractions of its width and height. Defaults to the
+                center of the block.
+
+        """
+        if isinstance(text, list):
+            text = u"\n".join(text)
+        key = (text, tuple(loc), width, align, tuple(anchor))
+        batch = self._layouts.get(key)
+        if batch is None:
+            self._ensure(text)
+            batch = self._batch(self._layout(text, loc, width, align, anchor))
+            self._layouts[key] = batch
+            while len(self._layouts) > self.max_layouts:
+                self._layouts.popitem(last=False)
+        else:
+            self._layouts.move_to_end(key)
+
+        sdlrenderer = self.renderer.sdlrenderer
+        if self._geometry:
+            vertices, indices = batch
+            if len(indices):
+                sdl2.SDL_RenderGeometry(
+                    sdlrenderer, self.texture.tx, vertices, len(vertices),
+                    indices, len(indices)
+                )
+        else:
+            for src, dst in batch:
+                sdl2.SDL_RenderCopy(sdlrenderer, self.texture.tx, src, dst)
+
+    def draw_line(self, text, x, y):
+        """Draws a single line of text with its top-left corner at (x, y).
+
+        Unlike `draw`, the layout isn't cached, so this is best suited to
+        short pieces of text (e.g. a single typed character).
+
+        Returns:
+            int: The x coordinate of the end of the drawn text.
+
+        """
+        self._ensure(text)
+        h = self.line_height
+        for gx, gy, w, dx, dy in self._line_quads(text, x, y):
+            sdl2.SDL_RenderCopy(
+                self.renderer.sdlrenderer, self.texture.tx,
+                sdl2.SDL_Rect(gx, gy, w, h), sdl2.SDL_Rect(dx, dy, w, h)
+            )
+        return x + self.width(text)
+
+    def destroy(self):
+        """Frees the atlas texture.
+
+        """
+        if self.texture:
+            self.texture.destroy()
+            self.texture = None
+        self._layouts.clear()
+
+
+def _rgba(color):
+    # Converts an RGB or RGBA color to an RGBA tuple
+    color = tuple(color)
+    return color if len(color) == 4 else color + (255,)
+
+
+class StimulusCache(object):
+    """Circle stimuli for a renderer, drawn once and packed into one texture.
+
+    Drawing a circle with `resources.draw_circle` goes through PIL, aggdraw,
+    and an SDL surface, so this cache draws each distinct stimulus (radius,
+    fill, and stroke) once and packs them all into a single atlas texture.
+    Stimuli are then drawn by copying their region of the atlas. Each cache
+    belongs to a single renderer.
+
+    Call `prewarm` with all the stimuli a session will use before the first
+    trial. Stimuli that aren't in the atlas yet are added (by rebuilding the
+    atlas) the first time they're used.
+
+    Colors are given as (r, g, b) or (r, g, b, a) tuples, and strokes as
+    (color, width) tuples, rather than aggdraw Brush and Pen objects, so
+    that they can be used as cache keys.
+
+    Args:
+        renderer (sdl2.ext.Renderer): The renderer the stimuli are drawn with.
+
+    """
+    def __init__(self, renderer):
+        self.renderer = renderer
+        self.texture = None
+        self._rects = {} # (radius, fill, stroke): (x, y, w, h) in the atlas
+        self.stats = {'hits': 0, 'misses': 0, 'builds': 0}
+
+    def _key(self, radius, fill=None, stroke=None):
+        if fill is not None:
+            fill = _rgba(fill)
+        if stroke is not None:
+            color, width = stroke
+            stroke = (_rgba(color), width)
+        return (radius, fill, stroke)
+
+    def __contains__(self, stimulus):
+        return self._key(*stimulus) in self._rects
+
+    def _build(self, keys):
+        # Draws each stimulus and packs them into rows of the atlas texture
+        info = sdl2.SDL_RendererInfo()
+        sdl2.SDL_GetRendererInfo(self.renderer.sdlrenderer, ctypes.byref(info))
+        atlas_w = min(info.max_texture_width or 2048, 2048)
+
+        surfaces = []
+        x, y, row_h = 0, 0, 0
+        for key in sorted(keys, key=lambda k: -k[0]):
+            radius, fill, stroke = key
+            sf = draw_circle(
+                radius, Brush(fill) if fill else None,
+                Pen(*stroke) if stroke else None
+            )
+            w, h = sf.w, sf.h
+            if x + w > atlas_w:
+                x, y, row_h = 0, y + row_h + 1, 0
+            surfaces.append((key, sf, (x, y, w, h)))
+            x += w + 1
+            row_h = max(row_h, h)
+
+        atlas = sdl2.SDL_CreateRGBSurfaceWithFormat(
+            0, atlas_w, y + row_h, 32, sdl2.SDL_PIXELFORMAT_ARGB8888
+        )
+        rects = {}
+        for key, sf, rect in surfaces:
+            # Copy the stimulus' pixels as-is, including its transparency
+            sdl2.SDL_SetSurfaceBlendMode(sf, sdl2.SDL_BLENDMODE_NONE)
+            sdl2.SDL_BlitSurface(sf, None, atlas, sdl2.SDL_Rect(*rect))
+            sdl2.SDL_FreeSurface(sf)
+            rects[key] = rect
+        try:
+            texture = sdl2.ext.Texture(self.renderer, atlas.contents)
+        finally:
+            sdl2.SDL_FreeSurface(atlas)
+        sdl2.SDL_SetTextureBlendMode(texture.tx, sdl2.SDL_BLENDMODE_BLEND)
+
+        if self.texture:
+            self.texture.destroy()
+        self.texture = texture
+        self._rects = rects
+        self.stats['builds'] += 1
+
+    def prewarm(self, stimuli):
+        """Draws a set of stimuli ahead of time, building the atlas once.
+
+        Args:
+            stimuli (list): The stimuli to draw, as (radius, fill, stroke)
+                tuples (fill and stroke can be None or left off).
+
+        """
+        keys = set(self._rects) | set(self._key(*s) for s in stimuli)
+        if keys != set(self._rects):
+            self._build(keys)
+
+    def get(self, radius, fill=None, stroke=None):
+        """Gets the atlas region of a stimulus, drawing it if necessary.
+
+        Args:
+            radius (float): The radius of the circle, in pixels.
+            fill (tuple, optional): The fill color of the circle. Defaults to
+                None (no fill).
+            stroke (tuple, optional): The (color, width) of the circle's
+                outline. Defaults to None (no outline).
+
+        Returns:
+            tuple: The atlas texture, and the (x, y, w, h) rect of the
+            stimulus within it.
+
+        """
+        key = self._key(radius, fill, stroke)
+        if key in self._rects:
+            self.stats['hits'] += 1
+        else:
+            self.stats['misses'] += 1
+            self._build(set(self._rects) | {key})
+        return self.texture, self._rects[key]
+
+    def draw(self, radius, fill=None, stroke=None, loc=(0, 0), align=(0.5, 0.5)):
+        """Draws a stimulus to the renderer.
+
+        Args:
+            radius, fill, stroke: The stimulus to draw (see `get`).
+            loc (tuple): The (x, y) coordinates to draw the stimulus at.
+            align (tuple, optional): The point of the stimulus to place at
+                `loc`, as fractions of its width and height. Defaults to its
+                center.
+
+        """
+        texture, rect = self.get(radius, fill, stroke)
+        self.renderer.rcopy(texture, loc, align=align, srcrect=rect)
+
+    def destroy(self):
+        """Frees the atlas texture.
+
+        """
+        if self.texture:
+            self.texture.destroy()
+            self.texture = None
+        self._rects = {}
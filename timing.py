@@ -0,0 +1,289 @@
+import time
+import ctypes
+from math import ceil
+from collections import namedtuple
+
+import sdl2
+
+import resources
+from resources import pump, wait_events, peek_events
+
+# SDL2 tick counts and event timestamps are 32-bit millisecond counters
+_TICK_WRAP = 2 ** 32
+
+
+def _tick_delta(ticks, ref):
+    # Gets the signed difference between two tick counts, handling wrap-around
+    return (ticks - ref + _TICK_WRAP // 2) % _TICK_WRAP - _TICK_WRAP // 2
+
+
+class ClockAlignment(object):
+    """Maps SDL tick times (e.g. event timestamps) onto the perf_counter clock.
+
+    SDL stamps each input event with the value of its millisecond tick
+    counter (``SDL_GetTicks``) when the event was received, which is more
+    accurate than the time a polling loop gets around to noticing it. To
+    compare those timestamps with times from ``time.perf_counter``, this class
+    records the perf_counter time at which the SDL tick counter changes
+    (giving the offset between the clocks to within microseconds), and fits a
+    line through these sync points to correct for any drift between the two
+    clocks over the session.
+
+    Call `sync` regularly (e.g. at the start of each trial) to keep the
+    alignment up to date.
+
+    Args:
+        max_points (int, optional): The number of most recent sync points used
+            to fit the alignment. Defaults to 50.
+
+    """
+    def __init__(self, max_points=50):
+        self.max_points = max_points
+        self._points = [] # (unwrapped ticks in ms, perf_counter in s)
+        self._offset = None
+        self._rate = 1.0
+        if not self.sync(max_wait=0.1):
+            raise RuntimeError("SDL tick counter is not running.")
+
+    def sync(self, max_wait=0.003):
+        """Adds a sync point between the SDL tick counter and perf_counter.
+
+        Spins until the SDL tick counter increments (at most ~1 ms), so that
+        the perf_counter time of the start of a tick is known precisely.
+
+        Args:
+            max_wait (float, optional): The longest time to spin waiting for the
+                tick counter to change, in seconds. Defaults to 3 ms.
+
+        Returns:
+            bool: True if a sync point was added, otherwise False.
+
+        """
+        start = time.perf_counter()
+        ticks = sdl2.SDL_GetTicks()
+        while True:
+            now = time.perf_counter()
+            new_ticks = sdl2.SDL_GetTicks()
+            if new_ticks != ticks:
+                break
+            if now - start > max_wait:
+                return False
+
+        # Store ticks unwrapped relative to the first sync point
+        if self._points:
+            last_raw, last_ticks = self._last_raw, self._points[-1][0]
+            unwrapped = last_ticks + _tick_delta(new_ticks, last_raw)
+        else:
+            unwrapped = float(new_ticks)
+        self._last_raw = new_ticks
+        self._points.append((unwrapped, now))
+        self._points = self._points[-self.max_points:]
+        self._fit()
+        return True
+
+    def _fit(self):
+        # Fits perf = offset + rate * ticks / 1000 through the sync points
+        n = len(self._points)
+        mean_t = sum(p[0] for p in self._points) / n
+        mean_p = sum(p[1] for p in self._points) / n
+        sxx = sum((p[0] - mean_t) ** 2 for p in self._points)
+        if n > 1 and sxx > 0:
+            sxy = sum((p[0] - mean_t) * (p[1] - mean_p) for p in self._points)
+            self._rate = (sxy / sxx) * 1000.0
+        self._offset = mean_p - self._rate * mean_t / 1000.0
+
+    @property
+    def drift(self):
+        """float: The drift of the SDL clock relative to perf_counter, in parts
+        per million."""
+        return (self._rate - 1.0) * 1e6
+
+    def to_perf(self, ticks):
+        """Converts an SDL tick count to a perf_counter time.
+
+        Args:
+            ticks (int): A value of the SDL tick counter (e.g. an event
+                timestamp), in milliseconds.
+
+        Returns:
+            float: The corresponding time on the perf_counter clock, in
+            seconds.
+
+        """
+        unwrapped = self._points[-1][0] + _tick_delta(ticks, self._last_raw)
+        return self._offset + self._rate * unwrapped / 1000.0
+
+    def event_time(self, event):
+        """Gets the perf_counter time at which an SDL event occurred.
+
+        Since event timestamps only have millisecond resolution, the middle of
+        the millisecond is used.
+
+        Args:
+            event (sdl2.SDL_Event): The event.
+
+        Returns:
+            float: The time of the event on the perf_counter clock, in seconds.
+
+        """
+        return self.to_perf(event.common.timestamp) + 0.0005
+
+
+def precise_wait(duration, slack=0.002, on_events=None, consume=True):
+    """Waits for a precise duration while continuing to handle input events.
+
+    Most of the wait is spent blocked waiting for SDL events (so the CPU can
+    idle), and the last `slack` seconds are spent spinning on the clock, which
+    avoids the overshoot of ``time.sleep`` on systems with coarse timers.
+    Events are handled throughout the wait: any that arrive are passed to
+    `on_events`, and if it returns True the wait ends immediately (e.g. if the
+    participant releases a key too early).
+
+    With `consume` set to False, events are only peeked at: they are still
+    passed to `on_events` (e.g. to quit on Esc), but are left in the queue
+    for whatever waits for input next, as with a plain ``time.sleep``.
+
+    Args:
+        duration (float): The time to wait, in seconds.
+        slack (float, optional): How long before the end of the wait to stop
+            blocking and start spinning, in seconds. Defaults to 2 ms.
+        on_events (callable, optional): A function called with each list of
+            events received during the wait, which can return True to end the
+            wait early. Defaults to None, in which case events are left in
+            the queue.
+        consume (bool, optional): Whether events handled during the wait are
+            removed from the queue. Defaults to True.
+
+    Returns:
+        tuple: The time actually waited (in seconds), and whether the wait was
+        ended early by `on_events`.
+
+    """
+    start = time.perf_counter()
+    deadline = start + duration
+    seen = 0 # The number of queued events already passed on, when peeking
+    while True:
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            break
+        if on_events is not None and not consume:
+            # Poll the queue without removing events (so they can't be used to
+            # wake up early), passing on only the events that are new
+            events = peek_events()
+            if len(events) < seen:
+                seen = 0 # Something else took events from the queue
+            new, seen = events[seen:], len(events)
+            if new and on_events(new):
+                return time.perf_counter() - start, True
+            if remaining > slack:
+                time.sleep(min(remaining - slack, resources.event_max_latency / 1000.0))
+            continue
+        if on_events is None:
+            # Nothing to handle, so just sleep until it's time to spin
+            if remaining > slack:
+                time.sleep(remaining - slack)
+            continue
+        if remaining > slack:
+            events = wait_events(int((remaining - slack) * 1000))
+        else:
+            events = pump()
+        if events and on_events(events):
+            return time.perf_counter() - start, True
+    return time.perf_counter() - start, False
+
+
+# The result of presenting a frame: when it reached the screen (as measured
+# on the perf_counter clock), when present was called, and how many frames
+# later than expected it was
+Flip = namedtuple('Flip', ['time', 'requested', 'late_frames'])
+
+
+class FrameScheduler(object):
+    """Presents frames in sync with the display and measures when they appear.
+
+    With a vsync-enabled renderer (e.g. the experiment's '-hardware' mode),
+    ``present`` blocks until the frame is shown at the next vertical blank,
+    so the time it returns is the time the frame reached the screen. The
+    scheduler records that time for every frame it presents. For frames
+    requested shortly after a previous flip (e.g. after `align`), it also
+    checks the time against the display's refresh interval to count frames
+    that appeared later than the next vertical blank after they were
+    requested (i.e. dropped frames).
+
+    To present a stimulus as soon as possible after a known vertical blank,
+    call `align` on a blank frame first and then draw and `flip` the
+    stimulus.
+
+    Without vsync (e.g. the software renderer), frames are shown whenever the
+    window is next updated, so flip times are the best available estimate
+    (the time ``present`` returned) and late frames are not counted.
+
+    Args:
+        renderer (sdl2.ext.Renderer): The renderer to present frames with.
+        refresh_rate (float, optional): The refresh rate of the display in Hz.
+            Defaults to the refresh rate reported by SDL for the renderer's
+            window (or 60 Hz if unknown).
+
+    """
+    def __init__(self, renderer, refresh_rate=None):
+        self.renderer = renderer
+        info = sdl2.SDL_RendererInfo()
+        sdl2.SDL_GetRendererInfo(renderer.sdlrenderer, ctypes.byref(info))
+        # NOTE: The software renderer reports vsync support, but its frames
+        # aren't actually synchronized with the display
+        software = info.flags & sdl2.SDL_RENDERER_SOFTWARE
+        self.vsync = bool(info.flags & sdl2.SDL_RENDERER_PRESENTVSYNC) and not software
+
+        if not refresh_rate:
+            mode = sdl2.SDL_DisplayMode()
+            window = sdl2.SDL_RenderGetWindow(renderer.sdlrenderer)
+            if window and sdl2.SDL_GetWindowDisplayMode(window, ctypes.byref(mode)) == 0:
+                refresh_rate = mode.refresh_rate
+        self.refresh_rate = float(refresh_rate or 60)
+        self.frame_duration = 1.0 / self.refresh_rate
+
+        self.last_flip = None
+        self.flips = 0
+        self.late_frames = 0
+
+    def flip(self):
+        """Presents the current frame and records when it reached the screen.
+
+        Returns:
+            Flip: The time the frame was shown, the time it was requested, and
+            the number of frames later than expected it was shown.
+
+        """
+        requested = time.perf_counter()
+        self.renderer.present()
+        shown = time.perf_counter()
+
+        late = 0
+        fd = self.frame_duration
+        since_last = None
+        if self.last_flip is not None:
+            since_last = max(requested - self.last_flip, 0)
+        # Only check for late frames shortly after a previous flip, since the
+        # timing of vertical blanks isn't known precisely enough after that
+        if self.vsync and since_last is not None and since_last < 2 * fd:
+            # The frame should have been shown on the first vertical blank
+            # after it was requested
+            expected = self.last_flip + max(ceil(since_last / fd), 1) * fd
+            late = max(0, int(round((shown - expected) / fd)))
+        self.last_flip = shown
+        self.flips += 1
+        self.late_frames += late
+        return Flip(shown, requested, late)
+
+    def align(self):
+        """Presents the current frame to synchronize with the display.
+
+        Draw a blank (or unchanged) frame before calling this: once it
+        returns, a vertical blank has just passed, so the next frame
+        presented with `flip` will appear exactly one refresh later.
+
+        Returns:
+            Flip: The timing of the presented frame.
+
+        """
+        return self.flip()
@@ -0,0 +1,254 @@
+"""A binary log of when trigger writes were sent to the hardware.
+
+Each write made by a TriggerDispatcher (trigger pulses, goggle writes, and
+any ports held during a pulse) is recorded as a fixed-size event with the
+block and trial it was sent in, the port and value written, and the
+``perf_counter_ns`` times just before and after the write. For a U3, each
+write is a single USB transaction, so the time between the two (minus the
+pulse duration) is the round trip to the device.
+
+Events are kept in a fixed-size ring buffer in memory, so recording one never
+touches the disk, and are appended to the log file when `TriggerLog.flush` is
+called (e.g. at the end of each block). The file starts with a short JSON
+header containing the trigger code names::
+
+    b'TRIGLOG1' | header length (uint32) | header (JSON) | events...
+
+Use `read_trigger_log` to load a log, and `join_triggers` to add the time of
+each trigger code to the trial rows of a data table.
+
+"""
+import io
+import os
+import json
+import time
+import struct
+import threading
+
+import numpy as np
+
+from communication import LABJACK_PORTS
+
+_MAGIC = b'TRIGLOG1'
+_HEADER_LEN = struct.Struct('<I')
+
+# The kinds of writes recorded in the log: a value written to a port and left
+# set, a trigger code reset to 0 after 'duration_us', and a value written to
+# another port at the same time as a pulse
+WRITE, PULSE, HOLD = 0, 1, 2
+_KINDS = {'write': WRITE, 'pulse': PULSE, 'hold': HOLD}
+
+EVENT_DTYPE = np.dtype([
+    ('before_ns', '<i8'), # perf_counter_ns just before the write
+    ('after_ns', '<i8'), # perf_counter_ns once the write had finished
+    ('duration_us', '<u4'), # the pulse duration, for pulses
+    ('block_num', '<u2'),
+    ('trial_num', '<u2'),
+    ('value', 'u1'),
+    ('port', 'u1'), # the index of the port in LABJACK_PORTS
+    ('kind', 'u1'),
+    ('pad', 'u1'),
+])
+
+
+def read_trigger_log(path):
+    """Reads the header and all complete events from a trigger log.
+
+    Args:
+        path (str): The path of the trigger log file.
+
+    Returns:
+        tuple: The header of the log (a dict, including the trigger 'codes'),
+        and a structured array of events (see `EVENT_DTYPE`).
+
+    """
+    with io.open(path, 'rb') as f:
+        data = f.read()
+    if data[:len(_MAGIC)] != _MAGIC:
+        raise RuntimeError("'{0}' is not a trigger log.".format(path))
+    start = len(_MAGIC) + _HEADER_LEN.size
+    length, = _HEADER_LEN.unpack_from(data, len(_MAGIC))
+    header = json.loads(data[start:start + length].decode('utf-8'))
+    body = data[start + length:]
+    # Ignore any partially-written event at the end of the file
+    n = len(body) // EVENT_DTYPE.itemsize
+    events = np.frombuffer(body[:n * EVENT_DTYPE.itemsize], dtype=EVENT_DTYPE)
+    return header, events
+
+
+def join_triggers(table, path):
+    """Adds the timing of each trigger code to the trials of a data table.
+
+    For each trigger code in the log, adds the host time the code was sent
+    ('<code>_time', in seconds on the perf_counter clock) and the round-trip
+    time of the write to the hardware ('<code>_latency', in ms, not including
+    the pulse duration) to the trial it was sent in, matching trials by their
+    'block_num' and 'trial_num'. If a code was sent more than once in a trial
+    (e.g. a trial that was repeated after resuming), the last one is used.
+    Trials with no events for a code get NaN.
+
+    Args:
+        table (dict): A table from `analysis.load_file` for the same session.
+        path (str): The path of the session's trigger log.
+
+    Returns:
+        dict: A copy of the table with the trigger columns added.
+
+    """
+    if 'block_num' not in table or 'trial_num' not in table:
+        raise RuntimeError(
+            "Data is missing the 'block_num' and 'trial_num' columns needed "
+            "to join trigger events to trials."
+        )
+    header, events = read_trigger_log(path)
+    pulses = events[events['kind'] == PULSE]
+
+    # Give each trial and event a single key to match them on
+    row_keys = (np.asarray(table['block_num'], dtype=np.int64) << 16) + \
+        np.asarray(table['trial_num'], dtype=np.int64)
+    event_keys = (pulses['block_num'].astype(np.int64) << 16) + \
+        pulses['trial_num'].astype(np.int64)
+
+    out = dict(table)
+    for name, value in header['codes'].items():
+        code = pulses[pulses['value'] == value]
+        keys = event_keys[pulses['value'] == value]
+        times = np.full(len(row_keys), np.nan)
+        latency = np.full(len(row_keys), np.nan)
+        if len(code):
+            # Keep the last event for each trial
+            order = np.argsort(keys, kind='stable')
+            keys, code = keys[order], code[order]
+            last = np.append(keys[1:] != keys[:-1], True)
+            keys, code = keys[last], code[last]
+            idx = np.clip(np.searchsorted(keys, row_keys), 0, len(keys) - 1)
+            found = keys[idx] == row_keys
+            code = code[idx]
+            rtt_ns = code['after_ns'] - code['before_ns'] - code['duration_us'] * 1000
+            times[found] = code['before_ns'][found] / 1e9
+            latency[found] = rtt_ns[found] / 1e6
+        out[name + '_time'] = times
+        out[name + '_latency'] = latency
+    return out
+
+
+class TriggerLog(object):
+    """Records trigger writes in a ring buffer and appends them to a file.
+
+    Attach the log to a TriggerDispatcher (``dispatcher.log = log``) to record
+    all of its writes, and call `set_trial` before each trial so events are
+    tagged with the trial they were sent in.
+
+    Args:
+        path (str): The path of the log file.
+        codes (dict, optional): The trigger code names and values, saved in
+            the file header so `join_triggers` can name the events.
+        resume (bool, optional): If True and the file already exists, append
+            to it. Otherwise, any existing log at the path is replaced.
+            Defaults to False.
+        capacity (int, optional): The number of events the ring buffer holds
+            between flushes. If more are recorded, the oldest are overwritten
+            (and counted in `dropped`). Defaults to 65536.
+
+    """
+    def __init__(self, path, codes=None, resume=False, capacity=65536):
+        self.path = path
+        self.block_num = 0
+        self.trial_num = 0
+        self.dropped = 0
+        self._events = np.zeros(capacity, dtype=EVENT_DTYPE)
+        self._next = 0 # The total number of events recorded
+        self._flushed = 0 # The number of events written to the file
+        self._lock = threading.Lock()
+
+        if not (resume and os.path.exists(path)):
+            header = {
+                'codes': dict(codes or {}), 'ports': LABJACK_PORTS,
+                'created': time.strftime("%Y-%m-%d %H:%M:%S"),
+            }
+            header = json.dumps(header).encode('utf-8')
+            with io.open(path, 'wb') as f:
+                f.write(_MAGIC + _HEADER_LEN.pack(len(header)) + header)
+            self._file = io.open(path, 'ab')
+        else:
+            # Drop any partially-written event left over from a crash
+            with io.open(path, 'rb') as f:
+                f.seek(len(_MAGIC))
+                length, = _HEADER_LEN.unpack(f.read(_HEADER_LEN.size))
+            header_size = len(_MAGIC) + _HEADER_LEN.size + length
+            body = os.path.getsize(path) - header_size
+            self._file = io.open(path, 'ab')
+            self._file.truncate(header_size + body - body % EVENT_DTYPE.itemsize)
+
+    def set_trial(self, block_num, trial_num):
+        """Sets the block and trial that following events are tagged with.
+
+        """
+        self.block_num = block_num
+        self.trial_num = trial_num
+
+    def record(self, kind, value, port, before_ns, after_ns, duration=0,
+               trial=None):
+        """Records a write in the ring buffer.
+
+        Args:
+            kind (str): The kind of write ('write', 'pulse', or 'hold').
+            value (int): The value written.
+            port (str): The name of the port written to (e.g. 'FIO').
+            before_ns (int): The ``perf_counter_ns`` time before the write.
+            after_ns (int): The ``perf_counter_ns`` time after the write.
+            duration (float, optional): The pulse duration in ms. Defaults
+                to 0.
+            trial (tuple, optional): The (block_num, trial_num) the write was
+                requested in. Defaults to the current trial.
+
+        """
+        block_num, trial_num = trial or (self.block_num, self.trial_num)
+        with self._lock:
+            event = self._events[self._next % len(self._events)]
+            event['before_ns'] = before_ns
+            event['after_ns'] = after_ns
+            event['duration_us'] = int(duration * 1000)
+            event['block_num'] = block_num
+            event['trial_num'] = trial_num
+            event['value'] = value & 0xFF
+            event['port'] = LABJACK_PORTS.index(port)
+            event['kind'] = _KINDS[kind]
+            self._next += 1
+
+    def flush(self):
+        """Appends all events recorded since the last flush to the file.
+
+        Returns:
+            int: The number of events written.
+
+        """
+        with self._lock:
+            if self._file is None:
+                return 0
+            size = len(self._events)
+            start = self._flushed
+            if self._next - start > size:
+                # Events were overwritten before they could be written
+                self.dropped += self._next - start - size
+                start = self._next - size
+            first, last = start % size, self._next % size
+            if first < last or start == self._next:
+                chunk = self._events[first:last].tobytes()
+            else:
+                chunk = self._events[first:].tobytes() + self._events[:last].tobytes()
+            n = self._next - start
+            self._flushed = self._next
+        self._file.write(chunk)
+        self._file.flush()
+        return n
+
+    def close(self):
+        """Writes any remaining events and closes the log file.
+
+        """
+        if self._file is None:
+            return
+        self.flush()
+        self._file.close()
+        self._file = None
@@ -0,0 +1,209 @@
+"""A simulated LabJack U3 for testing and benchmarking trigger code.
+
+Provides the parts of the LabJackPython ``u3`` module used by
+communication.U3Port (the ``U3`` device class, the ``PortStateWrite``,
+``WaitShort`` and ``WaitLong`` feedback commands, and ``deviceCount``), so
+the U3 trigger code can be run on any computer without the hardware or the
+LabJack driver. To use it in the experiment, run it with the '-simulate-u3'
+flag, or get a port with ``get_trigger_port(simulate=True)``.
+
+Each call to the device takes a configurable round-trip time with random
+jitter (plus any waits in a feedback command, as on the real device), and
+every change to the digital IO ports is recorded with the time it happened,
+so the timing of pulses can be checked afterwards::
+
+    dev = u3sim.U3(latency=0.001, jitter=0.0002)
+    port = U3Port(dev, u3=u3sim)
+    port.pulse(4)
+    print(dev.history) # [(time, FIO, EIO, CIO), ...]
+
+Failures can be injected with `fail_rate` (random errors on individual
+calls), `fail_after` (a disconnect after a given number of calls), or by
+calling `disconnect` directly.
+
+"""
+import time
+import random
+
+# Wait units for feedback commands on U3 hardware 1.30 or later (in seconds)
+WAIT_SHORT = 128e-6
+WAIT_LONG = 32e-3
+
+# The digital IO state registers, and the number of pins on each port
+_REGISTERS = {6700: 'FIO', 6701: 'EIO', 6702: 'CIO'}
+_PORTS = ['FIO', 'EIO', 'CIO']
+_MASKS = {'FIO': 0xFF, 'EIO': 0xFF, 'CIO': 0x0F}
+
+
+class LabJackException(Exception):
+    """An error communicating with the (simulated) device."""
+    pass
+
+
+class PortStateWrite(object):
+    """Sets the state of the pins in the write mask on each port.
+
+    Args:
+        State (list): The (FIO, EIO, CIO) states to write.
+        WriteMask (list): The (FIO, EIO, CIO) masks of the pins to change.
+
+    """
+    def __init__(self, State, WriteMask=[0xFF, 0xFF, 0xFF]):
+        self.state = list(State)
+        self.mask = list(WriteMask)
+
+
+class WaitShort(object):
+    """Waits on the device for a given number of short (128 us) units."""
+    def __init__(self, Time):
+        self.time = Time
+
+
+class WaitLong(object):
+    """Waits on the device for a given number of long (32 ms) units."""
+    def __init__(self, Time):
+        self.time = Time
+
+
+def deviceCount(devType=None):
+    """Gets the number of connected devices (always one simulated U3).
+
+    """
+    return 1
+
+
+class U3(object):
+    """A simulated U3 device.
+
+    Args:
+        latency (float, optional): The mean round-trip time of each call to
+            the device, in seconds. Defaults to 1 ms.
+        jitter (float, optional): The standard deviation of the round-trip
+            time, in seconds. Defaults to 0.2 ms.
+        fail_rate (float, optional): The probability of each call failing
+            with a LabJackException. Defaults to 0.
+        fail_after (int, optional): The number of calls after which the device
+            disconnects, so that all further calls fail. Defaults to None
+            (never disconnect).
+        hardwareVersion (float, optional): The hardware version to report.
+            Versions before 1.30 have half-length wait units. Defaults to 1.30.
+        seed (int, optional): The seed for the random latencies and failures.
+
+    """
+    def __init__(self, latency=0.001, jitter=0.0002, fail_rate=0.0,
+                 fail_after=None, hardwareVersion=1.30, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.fail_rate = fail_rate
+        self.fail_after = fail_after
+        self.hardwareVersion = hardwareVersion
+        self.connected = True
+        self.calls = 0
+        self.failures = 0
+        self.state = {port: 0 for port in _PORTS}
+        self.history = [] # (perf_counter time, FIO, EIO, CIO) after each change
+        self._random = random.Random(seed)
+        self._wait_short = WAIT_SHORT
+        self._wait_long = WAIT_LONG
+        if hardwareVersion < 1.3:
+            self._wait_short /= 2
+            self._wait_long /= 2
+
+    def disconnect(self):
+        """Simulates unplugging the device, so all further calls fail.
+
+        """
+        self.connected = False
+
+    def reconnect(self):
+        """Simulates plugging the device back in.
+
+        """
+        self.connected = True
+
+    def _call(self):
+        # Checks for injected failures and gets the round-trip time of a call
+        self.calls += 1
+        if self.fail_after is not None and self.calls > self.fail_after:
+            self.connected = False
+        if not self.connected:
+            self.failures += 1
+            raise LabJackException("Could not write to the U3 (disconnected).")
+        if self.fail_rate and self._random.random() < self.fail_rate:
+            self.failures += 1
+            raise LabJackException("Could not write to the U3 (transient error).")
+        return max(self._random.gauss(self.latency, self.jitter), 0)
+
+    def _set(self, port, state, mask):
+        mask &= _MASKS[port]
+        self.state[port] = (self.state[port] & ~mask) | (state & mask)
+
+    def _record(self, when):
+        self.history.append((when, self.state['FIO'], self.state['EIO'], self.state['CIO']))
+
+    def _finish(self, start, duration):
+        # Waits until the end of a call that started at `start`
+        end = start + duration
+        while time.perf_counter() < end:
+            remaining = end - time.perf_counter()
+            if remaining > 0.001:
+                time.sleep(remaining - 0.001)
+
+    def getCalibrationData(self):
+        self._finish(time.perf_counter(), self._call())
+
+    def configU3(self, FIODirection=None, FIOState=None, FIOAnalog=None,
+                 EIODirection=None, EIOState=None, EIOAnalog=None,
+                 CIODirection=None, CIOState=None):
+        start = time.perf_counter()
+        rtt = self._call()
+        for port, state in zip(_PORTS, (FIOState, EIOState, CIOState)):
+            if state is not None:
+                self._set(port, state, 0xFF)
+        self._record(start + rtt / 2)
+        self._finish(start, rtt)
+
+    def writeRegister(self, addr, value):
+        """Writes a value to a register (only the digital IO state registers,
+        6700-6702, are supported). The high byte of the value is the mask of
+        the pins to write, and the low byte is their state.
+
+        """
+        start = time.perf_counter()
+        if addr not in _REGISTERS:
+            raise LabJackException("Register {0} is not simulated.".format(addr))
+        rtt = self._call()
+        self._set(_REGISTERS[addr], value & 0xFF, (value >> 8) & 0xFF)
+        self._record(start + rtt / 2)
+        self._finish(start, rtt)
+
+    def getFeedback(self, *commands):
+        """Runs a list of feedback commands on the device in one transaction.
+
+        Port writes happen halfway through the round trip (plus the length of
+        any waits before them), and the call returns once all the commands
+        and the rest of the round trip are done.
+
+        """
+        start = time.perf_counter()
+        rtt = self._call()
+        when = start + rtt / 2
+        for cmd in commands:
+            if isinstance(cmd, PortStateWrite):
+                for i, port in enumerate(_PORTS):
+                    if cmd.mask[i]:
+                        self._set(port, cmd.state[i], cmd.mask[i])
+                self._record(when)
+            elif isinstance(cmd, WaitShort):
+                when += cmd.time * self._wait_short
+            elif isinstance(cmd, WaitLong):
+                when += cmd.time * self._wait_long
+            else:
+                raise LabJackException(
+                    "Feedback command {0} is not simulated.".format(type(cmd).__name__)
+                )
+        self._finish(start, when - start + rtt / 2)
+        return [None] * len(commands)
+
+    def close(self):
+        self.connected = False